@@ -1,87 +1,142 @@
 import os
+import random
 import re
 import time
 import uuid
 import hashlib
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, request, jsonify, render_template
-from openai import OpenAI
+import shutil
+import tempfile
+import threading
+from collections import Counter, deque
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, render_template, send_file
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from scheduler import AdmissionRejected, BATCH, INTERACTIVE, create_scheduler
+from ledger import FailureLedger, RepairWorker, UpstreamHealth
+from planner import ChunkPlanner
+from tracing import NULL_CHUNK_TRACE, NULL_REQUEST_TRACE, RequestTrace, current_chunk_trace, purge_traces
 
 # 设置默认API密钥
 DEFAULT_API_KEY = os.environ.get('OPENAI_API_KEY', '')
 DEFAULT_MODEL = 'gpt-4o-mini'
 DEFAULT_TEMPERATURE = 0.1
-MAX_WORKERS = 4  # 设置最大工作线程数
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', 4))  # 设置最大工作线程数
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', 1800))  # 固定分块时每个翻译块的最大字符数
+INTERACTIVE_MAX_CHARS = 4000  # 不超过该长度的请求按交互式优先级调度
+
+# 自适应分块: 根据观测到的上游延迟和可用并发数为每个请求选择块数
+ADAPTIVE_CHUNKING = os.environ.get('ADAPTIVE_CHUNKING', '1') == '1'
+MIN_CHUNK_SIZE = int(os.environ.get('MIN_CHUNK_SIZE', 600))
+MAX_CHUNK_SIZE = int(os.environ.get('MAX_CHUNK_SIZE', 4000))
+
+# 大文档模式配置
+LARGE_DOC_MAX_BYTES = int(os.environ.get('LARGE_DOC_MAX_BYTES', 64 * 1024 * 1024))  # 上传大小上限
+LARGE_DOC_SEGMENT_SIZE = 8000  # 每次保护/分块处理的段落组大小
+LARGE_DOC_WINDOW = int(os.environ.get('LARGE_DOC_WINDOW', MAX_WORKERS * 2))  # 同时在途的块数
+LARGE_DOC_STALE_SECONDS = 3600  # .part 超过该时间没有写入视为已中断(如worker被杀)
+# 大文档译文、失败标记和失败块台账的保留秒数, 两者一致, 下载时总能找到对应的修复记录
+DOCUMENT_RETENTION = float(os.environ.get('DOCUMENT_RETENTION', 30 * 24 * 60 * 60))
+
+# 流量录制: 设置CAPTURE_PATH后,把匿名化的请求形态追加写入该JSONL文件
+CAPTURE_PATH = os.environ.get('CAPTURE_PATH', '')
+CAPTURE_SALT = os.environ.get('CAPTURE_SALT', '')
+
+# 失败块后台修复的轮询间隔(秒)
+REPAIR_INTERVAL = float(os.environ.get('REPAIR_INTERVAL', 10))
+
+# 请求追踪: 请求中指定trace/profile时开启, 也可以按比例随机开启
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+TRACE_RETENTION = float(os.environ.get('TRACE_RETENTION', 7 * 24 * 60 * 60))  # 追踪文件保留秒数
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
-
-# 确保 static 和 cache 目录存在
+# static 目录随仓库提交, cache 目录在首次写缓存时再创建, 导入模块时不做任何磁盘写入
 static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
-cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
-for directory in [static_dir, cache_dir]:
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-# 创建SVG logo和favicon
-def create_svg_files():
-    # 创建logo.svg
-    logo_svg = '''<svg width="120" height="120" viewBox="0 0 120 120" xmlns="http://www.w3.org/2000/svg">
-  <!-- 背景圆形 -->
-  <circle cx="60" cy="60" r="55" fill="#0071e3"/>
-  
-  <!-- 匠字 - 简化版 -->
-  <path d="M40,35 h40 M40,55 h40 M60,35 v50 M45,85 h30" stroke="white" stroke-width="8" stroke-linecap="round" stroke-linejoin="round" fill="none"/>
-  
-  <!-- 翻译图标元素 -->
-  <path d="M30,70 L35,60 L40,70" stroke="white" stroke-width="3" fill="none" stroke-linecap="round" stroke-linejoin="round"/>
-  <path d="M80,70 L85,60 L90,70" stroke="white" stroke-width="3" fill="none" stroke-linecap="round" stroke-linejoin="round"/>
-</svg>'''
-    
-    # 创建favicon.svg
-    favicon_svg = '''<svg width="64" height="64" viewBox="0 0 64 64" xmlns="http://www.w3.org/2000/svg">
-  <!-- 背景圆形 -->
-  <circle cx="32" cy="32" r="30" fill="#0071e3"/>
-  
-  <!-- 匠字 - 简化版 -->
-  <path d="M20,20 h24 M20,32 h24 M32,20 v28 M24,48 h16" stroke="white" stroke-width="4" stroke-linecap="round" stroke-linejoin="round" fill="none"/>
-</svg>'''
-    
-    # 保存SVG文件
-    with open(os.path.join(static_dir, 'logo.svg'), 'w') as f:
-        f.write(logo_svg)
-    
-    with open(os.path.join(static_dir, 'favicon.svg'), 'w') as f:
-        f.write(favicon_svg)
-
-# 创建SVG文件
-create_svg_files()
+cache_dir = os.environ.get('CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+documents_dir = os.path.join(cache_dir, 'documents')
+traces_dir = os.path.join(cache_dir, 'traces')
+
+bp = Blueprint('main', __name__)
+
+# 所有请求共享的翻译块调度器, 工作线程在第一次提交时启动
+chunk_scheduler = create_scheduler(MAX_WORKERS)
+chunk_planner = ChunkPlanner(MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, chunk_scheduler.max_in_flight_per_document,
+                             chunk_scheduler.workers)
+
+# 失败块台账与上游健康状态, 修复线程在第一个请求到达时启动
+failure_ledger = FailureLedger(os.path.join(cache_dir, 'ledger.sqlite3'))
+upstream_health = UpstreamHealth()
+
+# OpenAI 客户端按 API 密钥复用, openai SDK 在第一次翻译时才导入
+_openai_clients = {}
+_openai_clients_lock = threading.Lock()
+
+def get_openai_client(api_key):
+    """
+    获取(并缓存)OpenAI客户端,延迟导入openai以加快进程启动
+    """
+    client = _openai_clients.get(api_key)
+    if client is None:
+        with _openai_clients_lock:
+            client = _openai_clients.get(api_key)
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(api_key=api_key)
+                _openai_clients[api_key] = client
+    return client
+
+# 缓存命中统计与录制文件锁
+_cache_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+_capture_lock = threading.Lock()
+_capture_salt = CAPTURE_SALT
+_last_trace_purge = 0.0
+_last_document_purge = 0.0
+
+# 预编译的正则表达式, 在所有请求之间共享
+CODE_BLOCK_RE = re.compile(r'```(?:.+?\n)?[\s\S]*?```')
+TABLE_RE = re.compile(r'(?:\|.+?\|[ \t]*\r?\n)+(?:\|[-: ]+?\|[ \t]*\r?\n)(?:\|.+?\|[ \t]*\r?\n)+')
+IMAGE_RE = re.compile(r'!\[(.*?)\]\((.*?)\)')
+LINK_RE = re.compile(r'\[(.*?)\]\((.*?)\)')
+INLINE_CODE_RE = re.compile(r'`[^`\n]+?`')
+LATEX_BLOCK_RE = re.compile(r'\$\$[\s\S]*?\$\$')
+LATEX_INLINE_RE = re.compile(r'\$[^$\n]+?\$')
+HTML_TAG_RE = re.compile(r'<[^>]+>[\s\S]*?</[^>]+>')
+URL_PLACEHOLDER_RE = re.compile(r'\[([^\]]*?)\]\((MD_url_[0-9a-f]{8})\)')
+IMG_PLACEHOLDER_RE = re.compile(r'!\[([^\]]*?)\]\((MD_img_[0-9a-f]{8})\)')
+PLACEHOLDER_RE = re.compile(r'MD_[a-z_]+_[0-9a-f]{8}')
+
+SECTION_TITLE_RE = re.compile(r'^#+\s+(.+?)$', re.MULTILINE)
+HEADER_RE = re.compile(r'^(#+)\s+(.+?)$', re.MULTILINE)
+PARAGRAPH_SPLIT_RE = re.compile(r'(\n\s*\n)')
+SENTENCE_SPLIT_RE = re.compile(r'([.!?。！？]\s+)')
+SECTION_MARK_RE = re.compile(r'\[SECTION:(.+?)\]')
+SECTION_MARK_STRIP_RE = re.compile(r'\[SECTION:.+?\]\n\n')
+FENCE_RE = re.compile(r'^\s*```')
+DOC_ID_RE = re.compile(r'^[0-9a-f]{32}$')
 
 # 定义一个类来处理Markdown元素的保护和恢复
 class MarkdownElementHandler:
+    # 保护的元素模式及优先级(类级别共享,只编译一次)
+    # 元组格式: (名称, 预编译正则, 优先级, 是否需要翻译内部文本)
+    PROTECTED_PATTERNS = sorted([
+        ('code_block', CODE_BLOCK_RE, 1, False),
+        ('table', TABLE_RE, 2, True),
+        ('image', IMAGE_RE, 3, True),
+        ('link', LINK_RE, 4, True),
+        ('inline_code', INLINE_CODE_RE, 5, False),
+        ('latex_block', LATEX_BLOCK_RE, 6, False),
+        ('latex_inline', LATEX_INLINE_RE, 7, False),
+        ('html_tag', HTML_TAG_RE, 8, False)
+    ], key=lambda x: x[2])  # 排序模式,确保更长的模式先处理
+
     def __init__(self):
-        # 保护的元素模式及优先级
-        self.protected_patterns = [
-            # 元组格式: (名称, 正则表达式模式, 优先级, 是否需要翻译内部文本)
-            ('code_block', r'```(?:.+?\n)?[\s\S]*?```', 1, False),
-            ('table', r'(?:\|.+?\|[ \t]*\r?\n)+(?:\|[-: ]+?\|[ \t]*\r?\n)(?:\|.+?\|[ \t]*\r?\n)+', 2, True),
-            ('image', r'!\[(.*?)\]\((.*?)\)', 3, True),
-            ('link', r'\[(.*?)\]\((.*?)\)', 4, True),
-            ('inline_code', r'`[^`\n]+?`', 5, False),
-            ('latex_block', r'\$\$[\s\S]*?\$\$', 6, False),
-            ('latex_inline', r'\$[^$\n]+?\$', 7, False),
-            ('html_tag', r'<[^>]+>[\s\S]*?</[^>]+>', 8, False)
-        ]
-        # 排序模式,确保更长的模式先处理
-        self.protected_patterns.sort(key=lambda x: x[2])
+        self.protected_patterns = self.PROTECTED_PATTERNS
     
     def protect_elements(self, text):
         """
@@ -95,7 +150,7 @@ class MarkdownElementHandler:
         for name, pattern, _, needs_translation in self.protected_patterns:
             if not needs_translation:
                 # 完全保护的元素,不需要翻译
-                matches = re.finditer(pattern, processed_text)
+                matches = pattern.finditer(processed_text)
                 for match in matches:
                     element = match.group(0)
                     element_id = f"MD_{name}_{str(uuid.uuid4())[:8]}"
@@ -118,9 +173,7 @@ class MarkdownElementHandler:
     def process_links(self, text, elements_map):
         """特殊处理链接,保留URL但允许翻译链接文本"""
         processed_text = text
-        link_pattern = r'\[(.*?)\]\((.*?)\)'
-        
-        matches = list(re.finditer(link_pattern, processed_text))
+        matches = list(LINK_RE.finditer(processed_text))
         # 从后向前替换,避免位置偏移问题
         for match in reversed(matches):
             full_link = match.group(0)
@@ -144,9 +197,7 @@ class MarkdownElementHandler:
     def process_images(self, text, elements_map):
         """特殊处理图片,保留URL但允许翻译图片描述"""
         processed_text = text
-        image_pattern = r'!\[(.*?)\]\((.*?)\)'
-        
-        matches = list(re.finditer(image_pattern, processed_text))
+        matches = list(IMAGE_RE.finditer(processed_text))
         # 从后向前替换,避免位置偏移问题
         for match in reversed(matches):
             full_image = match.group(0)
@@ -174,8 +225,7 @@ class MarkdownElementHandler:
         """
         # 对于复杂的表格,我们选择完整保护
         # 在实际应用中,可以开发更复杂的表格解析和处理逻辑
-        table_pattern = r'(?:\|.+?\|[ \t]*\r?\n)+(?:\|[-: ]+?\|[ \t]*\r?\n)(?:\|.+?\|[ \t]*\r?\n)+'
-        matches = re.finditer(table_pattern, text)
+        matches = TABLE_RE.finditer(text)
         
         processed_text = text
         for match in matches:
@@ -193,8 +243,7 @@ class MarkdownElementHandler:
         restored_text = text
         
         # 先处理URL占位符
-        url_pattern = r'\[([^\]]*?)\]\((MD_url_[0-9a-f]{8})\)'
-        url_matches = re.finditer(url_pattern, restored_text)
+        url_matches = URL_PLACEHOLDER_RE.finditer(restored_text)
         
         for match in url_matches:
             full_pattern = match.group(0)
@@ -207,8 +256,7 @@ class MarkdownElementHandler:
                 restored_text = restored_text.replace(full_pattern, restored_link, 1)
         
         # 处理图片占位符
-        img_pattern = r'!\[([^\]]*?)\]\((MD_img_[0-9a-f]{8})\)'
-        img_matches = re.finditer(img_pattern, restored_text)
+        img_matches = IMG_PLACEHOLDER_RE.finditer(restored_text)
         
         for match in img_matches:
             full_pattern = match.group(0)
@@ -221,8 +269,7 @@ class MarkdownElementHandler:
                 restored_text = restored_text.replace(full_pattern, restored_img, 1)
         
         # 处理其他占位符
-        placeholder_pattern = r'MD_[a-z_]+_[0-9a-f]{8}'
-        placeholders = re.findall(placeholder_pattern, restored_text)
+        placeholders = PLACEHOLDER_RE.findall(restored_text)
         
         for placeholder in placeholders:
             if placeholder in elements_map:
@@ -232,16 +279,16 @@ class MarkdownElementHandler:
         
         return restored_text
 
-def split_text_into_chunks(text, max_chunk_size=2500):
+def split_text_into_chunks(text, max_chunk_size=2500, default_section="无标题章节"):
     """
     将文本分割成较小的块,同时保持句子和段落的完整性
     """
     # 提取章节标题信息
-    section_match = re.search(r'^#+\s+(.+?)$', text, re.MULTILINE)
-    current_section = section_match.group(1) if section_match else "无标题章节"
+    section_match = SECTION_TITLE_RE.search(text)
+    current_section = section_match.group(1) if section_match else default_section
     
     # 按段落分割
-    paragraphs = re.split(r'(\n\s*\n)', text)
+    paragraphs = PARAGRAPH_SPLIT_RE.split(text)
     
     chunks = []
     current_chunk = []
@@ -252,7 +299,7 @@ def split_text_into_chunks(text, max_chunk_size=2500):
         separator = paragraphs[i+1] if i+1 < len(paragraphs) else ""
         
         # 检查段落是否为新章节标题
-        header_match = re.search(r'^(#+)\s+(.+?)$', paragraph.strip(), re.MULTILINE)
+        header_match = HEADER_RE.search(paragraph.strip())
         if header_match:
             level, title = header_match.groups()
             current_section = title
@@ -278,7 +325,7 @@ def split_text_into_chunks(text, max_chunk_size=2500):
                 current_size = 0
             
             # 然后处理长段落(尝试按句子分割)
-            sentences = re.split(r'([.!?。！？]\s+)', paragraph)
+            sentences = SENTENCE_SPLIT_RE.split(paragraph)
             
             sentence_chunk = []
             sentence_size = 0
@@ -314,6 +361,77 @@ def split_text_into_chunks(text, max_chunk_size=2500):
     
     return chunks
 
+def split_text_into_balanced_chunks(text, max_chunk_size):
+    """
+    在块数不超过按max_chunk_size切分的块数的前提下,让各块大小尽量均衡:
+    二分查找块数不变的最小块大小,从而让最大的块尽量小;结果只取决于文本和max_chunk_size
+    """
+    best = split_text_into_chunks(text, max_chunk_size=max_chunk_size)
+    target_chunks = len(best)
+    if target_chunks <= 1:
+        return best
+    
+    low = max(1, -(-len(text) // target_chunks))
+    high = max_chunk_size
+    while low < high:
+        middle = (low + high) // 2
+        chunks = split_text_into_chunks(text, max_chunk_size=middle)
+        if len(chunks) <= target_chunks:
+            best = chunks
+            high = middle
+        else:
+            low = middle + 1
+    return best
+
+def iter_document_segments(lines, segment_size=LARGE_DOC_SEGMENT_SIZE):
+    """
+    逐行读取文档,在空行处切分为段落组,不会切断代码块和LaTeX块;
+    段落组超过 segment_size * 4 时无论是否在块内都在行尾强制切分,
+    未闭合的代码块或奇数个$$不会让剩余内容全部落入同一个段落组
+    产出: (段落组文本, 段落组开始前所在的章节)
+    """
+    buffer = []
+    size = 0
+    in_fence = False
+    in_latex = False
+    section = "无标题章节"
+    segment_section = section
+    
+    for line in lines:
+        stripped = line.strip()
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and stripped.count('$$') % 2 == 1:
+            in_latex = not in_latex
+        
+        buffer.append(line)
+        size += len(line)
+        
+        # 超长时在行尾强制切分, 先于块内判断, 保证每个段落组的大小有上限
+        if size >= segment_size * 4:
+            yield ''.join(buffer), segment_section
+            buffer = []
+            size = 0
+            segment_section = section
+            continue
+        
+        if in_fence or in_latex:
+            continue
+        
+        header_match = HEADER_RE.match(stripped)
+        if header_match:
+            section = header_match.group(2)
+        
+        # 在空行处切分
+        if not stripped and size >= segment_size:
+            yield ''.join(buffer), segment_section
+            buffer = []
+            size = 0
+            segment_section = section
+    
+    if buffer:
+        yield ''.join(buffer), segment_section
+
 def get_translation_instruction(current_section=""):
     """
     获取翻译指令
@@ -381,10 +499,14 @@ def save_to_cache(cache_key, data):
     """
     cache_file = os.path.join(cache_dir, f"{cache_key}.json")
     try:
+        os.makedirs(cache_dir, exist_ok=True)
         # 添加时间戳
         data['timestamp'] = time.time()
-        with open(cache_file, 'w', encoding='utf-8') as f:
+        # 先写临时文件再替换, 避免并发读取到写了一半的缓存
+        tmp_file = f"{cache_file}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, cache_file)
         return True
     except Exception as e:
         logger.error(f"保存缓存失败: {e}")
@@ -394,16 +516,16 @@ def translate_text(text, api_key, model="gpt-4o-mini", temperature=0):
     """
     使用OpenAI API翻译文本
     """
-    client = OpenAI(api_key=api_key)
+    client = get_openai_client(api_key)
     
     # 提取章节信息
-    section_info = re.match(r'\[SECTION:(.+?)\]', text)
+    section_info = SECTION_MARK_RE.match(text)
     current_section = ""
     
     if section_info:
         current_section = section_info.group(1)
         # 移除章节标记
-        text = re.sub(r'\[SECTION:.+?\]\n\n', '', text)
+        text = SECTION_MARK_STRIP_RE.sub('', text)
     
     # 获取翻译指令
     instruction = get_translation_instruction(current_section)
@@ -411,65 +533,425 @@ def translate_text(text, api_key, model="gpt-4o-mini", temperature=0):
     try:
         logger.info(f"开始翻译,文本长度: {len(text)}字符")
         
-        # API调用
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": instruction},
-                {"role": "user", "content": f"以下是需要翻译的文章:\n\n{text}"}
-            ],
-            temperature=temperature,
-            timeout=60
-        )
+        # API调用(开启追踪时记录上游耗时和token数)
+        with current_chunk_trace().span('upstream', model=model, chars=len(text)) as upstream_args:
+            started = time.perf_counter()
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": instruction},
+                    {"role": "user", "content": f"以下是需要翻译的文章:\n\n{text}"}
+                ],
+                temperature=temperature,
+                timeout=60
+            )
+            elapsed = time.perf_counter() - started
+            usage = getattr(response, 'usage', None)
+            completion_tokens = usage.completion_tokens if usage is not None else 0
+            if usage is not None:
+                upstream_args['prompt_tokens'] = usage.prompt_tokens
+                upstream_args['completion_tokens'] = completion_tokens
+        
+        # 更新该模型的延迟统计, 供分块规划使用
+        chunk_planner.observe(model, len(text), elapsed, completion_tokens)
+        upstream_health.record(True)
         
         translated = response.choices[0].message.content
         return translated
             
     except Exception as e:
         logger.error(f"翻译错误: {str(e)}")
+        upstream_health.record(False)
         return f"[翻译错误: {str(e)}]"
 
-def translate_chunk(chunk, api_key, model, temperature):
+def translate_chunk(chunk, api_key, model, temperature, trace=None):
     """
     翻译单个文本块
     """
-    # 创建缓存键
-    chunk_key = create_cache_key(chunk, model, temperature)
-    chunk_cache = load_from_cache(chunk_key)
+    trace = trace or NULL_CHUNK_TRACE
+    # 只有章节标记、没有正文的块(段落组末尾的空段落)无需调用API, 否则空译文会被当作失败
+    body = SECTION_MARK_STRIP_RE.sub('', chunk)
+    if not body.strip():
+        return body
     
-    if chunk_cache and 'translated' in chunk_cache:
-        # 从缓存返回结果
-        logger.info(f"从缓存加载翻译结果,大小: {len(chunk_cache['translated'])}字符")
-        return chunk_cache['translated']
+    with trace.running(chars=len(chunk)) as chunk_args:
+        # 创建缓存键
+        with trace.span('cache_lookup') as lookup_args:
+            chunk_key = create_cache_key(chunk, model, temperature)
+            chunk_cache = load_from_cache(chunk_key)
+            lookup_args['hit'] = bool(chunk_cache and 'translated' in chunk_cache)
+        
+        with _stats_lock:
+            _cache_stats['hits' if lookup_args['hit'] else 'misses'] += 1
+        
+        if lookup_args['hit']:
+            # 从缓存返回结果
+            logger.info(f"从缓存加载翻译结果,大小: {len(chunk_cache['translated'])}字符")
+            return chunk_cache['translated']
+        
+        # 翻译当前块
+        max_retries = 2
+        for attempt in range(max_retries):
+            chunk_args['attempts'] = attempt + 1
+            try:
+                with trace.span(f"attempt {attempt+1}"):
+                    translated = translate_text(chunk, api_key, model, temperature)
+                
+                if translated and not translated.startswith("[翻译错误"):
+                    # 保存到缓存
+                    with trace.span('cache_write'):
+                        save_to_cache(chunk_key, {'translated': translated})
+                    return translated
+                
+                # 出错时,添加重试间隔
+                if attempt < max_retries - 1:
+                    with trace.span('backoff'):
+                        time.sleep(2 ** attempt)  # 指数退避策略
+                    
+            except Exception as e:
+                logger.error(f"翻译尝试 {attempt+1} 失败: {str(e)}")
+                if attempt < max_retries - 1:
+                    with trace.span('backoff'):
+                        time.sleep(2 ** attempt)
+        
+        chunk_args['failed'] = True
+        return f"[翻译失败: 已尝试 {max_retries} 次]"
+
+def is_failed_result(result):
+    """
+    判断块的结果是否为重试耗尽或线程异常产生的失败标记
+    """
+    return result.startswith("[翻译失败") or result.startswith("[翻译异常")
+
+def repair_chunk(chunk, model, temperature):
+    """
+    后台修复单个失败块, 以批量优先级经调度器执行
+    返回: (是否成功, 译文或失败信息)
+    """
+    future = chunk_scheduler.submit(
+        translate_chunk, chunk, DEFAULT_API_KEY, model, temperature,
+        client='repair', priority=BATCH, document='repair'
+    )
+    result = future.result()
+    return not is_failed_result(result), result
+
+repair_worker = RepairWorker(failure_ledger, upstream_health, repair_chunk, interval=REPAIR_INTERVAL,
+                             retention=DOCUMENT_RETENTION)
+
+def get_capture_salt():
+    """
+    录制使用的盐值: 未配置CAPTURE_SALT时使用cache目录下的capture_salt文件(首次录制时生成),
+    保证多个worker进程之间以及重启前后同一文档的指纹一致
+    """
+    global _capture_salt
+    if _capture_salt:
+        return _capture_salt
+    with _capture_lock:
+        if _capture_salt:
+            return _capture_salt
+        salt_path = os.path.join(cache_dir, 'capture_salt')
+        if not os.path.exists(salt_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            # 先写临时文件再link, 多个进程同时生成时只有一个会成功
+            tmp_path = f"{salt_path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(uuid.uuid4().hex)
+            try:
+                os.link(tmp_path, salt_path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+        with open(salt_path, 'r', encoding='utf-8') as f:
+            _capture_salt = f.read().strip()
+    return _capture_salt
+
+def anonymize(value):
+    """
+    加盐哈希,录制时用于替代原文和客户端标识
+    """
+    return hashlib.sha256(f"{get_capture_salt()}:{value}".encode('utf-8')).hexdigest()[:16]
+
+def count_elements(elements_map):
+    """
+    按类型统计被保护的元素数量,如 {'url': 3, 'code_block': 1}
+    """
+    return dict(Counter(key[3:].rsplit('_', 1)[0] for key in elements_map))
+
+def record_request_shape(shape):
+    """
+    开启CAPTURE_PATH时,把请求形态追加写入JSONL,不记录任何原文
+    """
+    if not CAPTURE_PATH:
+        return
+    try:
+        line = json.dumps(shape, ensure_ascii=False)
+        with _capture_lock:
+            with open(CAPTURE_PATH, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    except Exception as e:
+        logger.error(f"记录请求形态失败: {e}")
+
+def start_request_trace(data):
+    """
+    根据请求参数(trace/profile字段或X-Trace/X-Profile请求头)和采样率决定是否追踪,
+    不追踪时返回空实现
+    """
+    profile = bool(data.get('profile')) or request.headers.get('X-Profile') == '1'
+    enabled = (profile or bool(data.get('trace')) or request.headers.get('X-Trace') == '1'
+               or (TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE))
+    if not enabled:
+        return NULL_REQUEST_TRACE
+    trace = RequestTrace(uuid.uuid4().hex, profile=profile)
+    trace.start_profile()
+    return trace
+
+def finish_request_trace(trace, **info):
+    """
+    结束追踪并写入 traces 目录, info(如状态码、错误信息)写入追踪的 otherData;
+    每小时清理一次超过 TRACE_RETENTION 的旧追踪
+    """
+    global _last_trace_purge
+    if trace is NULL_REQUEST_TRACE:
+        return
+    trace.stop_profile()
+    trace.info.update(info)
+    try:
+        trace.export(os.path.join(traces_dir, f"{trace.trace_id}.json"))
+        logger.info(f"追踪已写入: {trace.trace_id}")
+    except Exception as e:
+        logger.error(f"写入追踪失败: {e}")
     
-    # 翻译当前块
-    max_retries = 2
-    for attempt in range(max_retries):
+    if time.time() - _last_trace_purge > 3600:
+        _last_trace_purge = time.time()
+        removed = purge_traces(traces_dir, TRACE_RETENTION)
+        if removed:
+            logger.info(f"清理了 {removed} 个过期追踪")
+
+def get_client_id():
+    """
+    公平排队使用的客户端标识: 优先使用X-Client-Id请求头,否则使用客户端IP
+    """
+    return request.headers.get('X-Client-Id') or (request.access_route[0] if request.access_route else 'anonymous')
+
+def admission_rejected_response(exc):
+    """
+    准入控制拒绝时返回429,并通过Retry-After告知重试时间
+    """
+    response = jsonify({
+        'error': f'服务繁忙,请在 {exc.retry_after} 秒后重试',
+        'retry_after': exc.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(exc.retry_after)
+    return response
+
+def translate_document_stream(lines, api_key, model, temperature, output_path,
+                              client='anonymous', document=None, window=LARGE_DOC_WINDOW):
+    """
+    大文档翻译流水线: 逐段保护并分块,同时在途的块数不超过window,
+    每段译文按原顺序恢复后追加写入output_path,并逐段产出;
+    含失败块的段落组写入文件时立即记入台账(不在内存中累积),由后台线程修复
+    """
+    document = document or uuid.uuid4().hex
+    md_handler = MarkdownElementHandler()
+    pending = deque()  # (future, 段状态, 是否为该段最后一块)
+    stats = {'chunks': 0, 'errors': 0, 'protected_elements': 0}
+    partial_path = output_path + '.part'
+    failed_path = output_path + '.failed'
+    stats['failed_segments'] = 0
+    written = 0  # 已写入输出文件的字节数
+    
+    def drain():
+        """等待最早的块完成, 所在段落组的块全部完成时返回该段状态"""
+        future, state, is_last = pending.popleft()
         try:
-            translated = translate_text(chunk, api_key, model, temperature)
-            
-            if translated and not translated.startswith("[翻译错误"):
-                # 保存到缓存
-                save_to_cache(chunk_key, {'translated': translated})
-                return translated
-            
-            # 出错时,添加重试间隔
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)  # 指数退避策略
+            result = future.result()
+        except Exception as exc:
+            logger.error(f"翻译线程生成异常: {exc}")
+            result = f"[翻译异常: {str(exc)}]"
+        if '[翻译' in result:
+            stats['errors'] += 1
+        state['translated'].append(result)
+        return state if is_last else None
+    
+    def write_segment(out, state):
+        """恢复并写入一个段落组, 记录含失败块的段落组在输出文件中的字节区间"""
+        nonlocal written
+        translated_content = '\n'.join(state['translated'])
+        restored = md_handler.restore_elements(translated_content, state['elements_map']) + '\n'
+        length = len(restored.encode('utf-8'))
+        failed_indexes = [i for i, result in enumerate(state['translated']) if is_failed_result(result)]
+        if failed_indexes:
+            # 译文在 os.replace 之前不会发布, 台账总是先于译文可见
+            try:
+                failure_ledger.record_segments(document, model, temperature, [{
+                    'index': state['index'],
+                    'offset': written,
+                    'length': length,
+                    'elements_map': state['elements_map'],
+                    'chunks': state['chunks'],
+                    'results': state['translated'],
+                    'failed_indexes': failed_indexes
+                }])
+                stats['failed_segments'] += 1
+            except Exception as e:
+                logger.error(f"写入失败块台账失败: {e}")
+        out.write(restored)
+        written += length
+        return restored
+    
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    try:
+        # newline='' 保证写入的字节数与记录的偏移一致
+        with open(partial_path, 'w', encoding='utf-8', newline='') as out:
+            try:
+                for segment_index, (segment, section) in enumerate(iter_document_segments(lines)):
+                    if not segment.strip():
+                        continue
+                    protected_text, elements_map = md_handler.protect_elements(segment)
+                    chunks = split_text_into_chunks(protected_text, max_chunk_size=CHUNK_SIZE, default_section=section)
+                    stats['protected_elements'] += len(elements_map)
+                    stats['chunks'] += len(chunks)
+                    state = {'index': segment_index, 'elements_map': elements_map, 'chunks': chunks, 'translated': []}
+                    
+                    for i, chunk in enumerate(chunks):
+                        # 窗口已满时,等待最早的块完成
+                        while len(pending) >= window:
+                            done = drain()
+                            if done is not None:
+                                yield write_segment(out, done)
+                        future = chunk_scheduler.submit(
+                            translate_chunk, chunk, api_key, model, temperature,
+                            client=client, priority=BATCH, document=document
+                        )
+                        pending.append((future, state, i == len(chunks) - 1))
                 
-        except Exception as e:
-            logger.error(f"翻译尝试 {attempt+1} 失败: {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)
+                while pending:
+                    done = drain()
+                    if done is not None:
+                        yield write_segment(out, done)
+            finally:
+                # 客户端断开或出错时,取消尚未开始的块
+                for future, _, _ in pending:
+                    future.cancel()
+    except BaseException as exc:
+        # 客户端断开或出错时删除未完成的译文并写入失败标记, /documents 据此返回410
+        reason = '客户端断开连接' if isinstance(exc, GeneratorExit) else str(exc)
+        logger.warning(f"大文档 {document} 翻译中断: {reason}")
+        try:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            with open(failed_path, 'w', encoding='utf-8') as f:
+                json.dump({'error': reason, 'timestamp': time.time()}, f, ensure_ascii=False)
+        except OSError as e:
+            logger.error(f"写入失败标记失败: {e}")
+        # 译文不会发布, 已记入台账的段落组无需再修复
+        if stats['failed_segments']:
+            try:
+                failure_ledger.delete_segments(document)
+            except Exception as e:
+                logger.error(f"删除失败块台账记录失败: {e}")
+        raise
+    
+    os.replace(partial_path, output_path)
+    if stats['failed_segments']:
+        logger.info(f"大文档 {document} 有 {stats['failed_segments']} 个段落组含失败块, 等待后台修复")
+    success_rate = (stats['chunks'] - stats['errors']) / stats['chunks'] * 100 if stats['chunks'] else 0
+    logger.info(f"大文档翻译完成: {stats['chunks']} 个块, 成功率 {success_rate:.1f}%, "
+                f"保护了 {stats['protected_elements']} 个特殊元素")
+
+def purge_documents():
+    """
+    清理 documents 目录: 删除超过 DOCUMENT_RETENTION 的译文和失败标记,
+    以及超过 LARGE_DOC_STALE_SECONDS 没有写入的 .part 文件(worker被杀后遗留)
+    每小时最多执行一次, 返回删除的文件数
+    """
+    global _last_document_purge
+    if time.time() - _last_document_purge <= 3600:
+        return 0
+    _last_document_purge = time.time()
     
-    return f"[翻译失败: 已尝试 {max_retries} 次]"
+    now = time.time()
+    removed = 0
+    try:
+        names = os.listdir(documents_dir)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        path = os.path.join(documents_dir, name)
+        max_age = LARGE_DOC_STALE_SECONDS if name.endswith('.part') else DOCUMENT_RETENTION
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"清理了 {removed} 个过期的大文档文件")
+    return removed
 
-@app.route('/')
+def save_upload_to_temp():
+    """
+    将上传内容(multipart的file字段或原始请求体)分块写入临时文件,不在内存中保留全文
+    返回: 临时文件路径,没有内容时返回None
+    """
+    fd, upload_path = tempfile.mkstemp(prefix='mdfanyi_', suffix='.md')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if request.mimetype == 'multipart/form-data':
+                upload = request.files.get('file')
+                if upload is not None:
+                    shutil.copyfileobj(upload.stream, f, 1024 * 1024)
+            else:
+                shutil.copyfileobj(request.stream, f, 1024 * 1024)
+    except BaseException:
+        # 上传超限或连接中断时删除临时文件
+        os.remove(upload_path)
+        raise
+    
+    if os.path.getsize(upload_path) == 0:
+        os.remove(upload_path)
+        return None
+    return upload_path
+
+def iter_repaired_document(output_path, segments, block_size=1024 * 1024):
+    """
+    逐块读取大文档译文, 把记录过失败块的段落组区间替换为台账中的当前版本
+    """
+    md_handler = MarkdownElementHandler()
+    with open(output_path, 'rb') as f:
+        position = 0
+        for segment in segments:
+            remaining = segment['offset'] - position
+            while remaining > 0:
+                block = f.read(min(block_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+            translated_content = '\n'.join(segment['results'])
+            yield (md_handler.restore_elements(translated_content, segment['elements_map']) + '\n').encode('utf-8')
+            position = segment['offset'] + segment['length']
+            f.seek(position)
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+@bp.before_app_request
+def start_repair_worker():
+    repair_worker.ensure_started()
+
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/translate', methods=['POST'])
+@bp.route('/translate', methods=['POST'])
 def translate():
+    arrived_at = time.time()
+    trace = NULL_REQUEST_TRACE
     try:
         data = request.json
         text = data.get('text', '')
@@ -486,24 +968,71 @@ def translate():
         if not text.strip():
             return jsonify({'error': '请提供要翻译的文本'}), 400
         
+        trace = start_request_trace(data)
+        
         # 创建Markdown元素处理器
         md_handler = MarkdownElementHandler()
         
         # 1. 保护Markdown特殊元素
-        protected_text, elements_map = md_handler.protect_elements(text)
+        with trace.span('protect_elements', chars=len(text)) as span_args:
+            protected_text, elements_map = md_handler.protect_elements(text)
+            span_args['elements'] = len(elements_map)
         logger.info(f"保护了 {len(elements_map)} 个特殊元素")
         
-        # 2. 分割文本为可管理的块
-        chunks = split_text_into_chunks(protected_text, max_chunk_size=1800)
-        logger.info(f"文本被分割为 {len(chunks)} 个块")
+        # 2. 分割文本为可管理的块, 块大小上限由规划器根据延迟统计从固定阶梯中选择,
+        #    与当前负载无关, 同一文本总是得到相同的块, 可以命中块缓存
+        with trace.span('split_text_into_chunks', adaptive=ADAPTIVE_CHUNKING) as span_args:
+            if ADAPTIVE_CHUNKING:
+                chunks, chunk_size, predicted_seconds = chunk_planner.plan(
+                    model, lambda size: split_text_into_balanced_chunks(protected_text, size))
+            else:
+                chunks = split_text_into_chunks(protected_text, max_chunk_size=CHUNK_SIZE)
+                chunk_size = CHUNK_SIZE
+                predicted_seconds = chunk_planner.predict(model, [len(chunk) for chunk in chunks])
+            span_args['chunk_size'] = chunk_size
+            span_args['chunk_sizes'] = [len(chunk) for chunk in chunks]
+        logger.info(f"文本被分割为 {len(chunks)} 个块, 上限 {chunk_size} 字符, 预计耗时 {predicted_seconds:.1f} 秒")
+        
+        # 3. 通过共享调度器并行翻译chunks, 短文本按交互式优先级调度
+        if data.get('priority') == BATCH or len(text) > INTERACTIVE_MAX_CHARS:
+            priority = BATCH
+        else:
+            priority = INTERACTIVE
+        
+        client = get_client_id()
+        if CAPTURE_PATH:
+            record_request_shape({
+                'ts': arrived_at,
+                'endpoint': '/translate',
+                'chars': len(text),
+                'headings': len(HEADER_RE.findall(text)),
+                'elements': count_elements(elements_map),
+                'chunks': len(chunks),
+                'model': model,
+                'temperature': temperature,
+                'priority': priority,
+                'client': anonymize(client),
+                'fingerprint': anonymize(text)
+            })
         
-        # 3. 使用线程池并行翻译chunks
-        translated_chunks = []
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            # 提交翻译任务
+        try:
+            chunk_scheduler.admit(priority, len(chunks))
+        except AdmissionRejected as exc:
+            logger.warning(f"准入控制拒绝请求: {exc}")
+            finish_request_trace(trace, status=429, error=str(exc))
+            response = admission_rejected_response(exc)
+            if trace.trace_id:
+                response.headers['X-Trace-Id'] = trace.trace_id
+            return response
+        
+        document = uuid.uuid4().hex
+        translate_started = time.perf_counter()
+        with trace.span('translate_chunks', priority=priority, chunks=len(chunks),
+                        predicted_seconds=round(predicted_seconds, 3)):
             future_to_chunk = {
-                executor.submit(
-                    translate_chunk, chunk, api_key, model, temperature
+                chunk_scheduler.submit(
+                    translate_chunk, chunk, api_key, model, temperature, trace.for_chunk(i),
+                    client=client, priority=priority, document=document
                 ): i for i, chunk in enumerate(chunks)
             }
             
@@ -516,33 +1045,248 @@ def translate():
                 except Exception as exc:
                     logger.error(f"翻译线程 {chunk_index} 生成异常: {exc}")
                     results[chunk_index] = f"[翻译异常: {str(exc)}]"
-            
-            translated_chunks = results
+        
+        translated_chunks = results
+        actual_seconds = time.perf_counter() - translate_started
+        chunk_planner.record_outcome(model, predicted_seconds, actual_seconds)
+        
+        # 失败块写入台账, 由后台线程在上游恢复后重新翻译
+        failed_indexes = [i for i, chunk in enumerate(translated_chunks) if is_failed_result(chunk)]
+        if failed_indexes:
+            try:
+                failure_ledger.record_document(document, model, temperature, elements_map,
+                                               chunks, translated_chunks, failed_indexes)
+                logger.info(f"文档 {document} 有 {len(failed_indexes)} 个失败块等待后台修复")
+            except Exception as e:
+                logger.error(f"写入失败块台账失败: {e}")
+                failed_indexes = []
         
         # 4. 合并翻译后的块
         translated_content = '\n'.join(translated_chunks)
         
         # 5. 恢复所有特殊Markdown元素
-        final_translated = md_handler.restore_elements(translated_content, elements_map)
+        with trace.span('restore_elements'):
+            final_translated = md_handler.restore_elements(translated_content, elements_map)
         
         # 获取翻译统计信息
         translation_errors = sum(1 for chunk in translated_chunks if '[翻译' in chunk)
         success_rate = (len(chunks) - translation_errors) / len(chunks) * 100 if chunks else 0
         
-        return jsonify({
+        finish_request_trace(trace, status=200)
+        result = {
             'translated_text': final_translated,
             'chunks': len(chunks),
             'success_rate': success_rate,
-            'protected_elements': len(elements_map)
-        })
+            'protected_elements': len(elements_map),
+            'plan': {
+                'chunk_size': chunk_size,
+                'chunk_sizes': [len(chunk) for chunk in chunks],
+                'concurrency': chunk_planner.concurrency,
+                'predicted_seconds': round(predicted_seconds, 3),
+                'actual_seconds': round(actual_seconds, 3)
+            }
+        }
+        if failed_indexes:
+            result['document_id'] = document
+            result['pending_repairs'] = len(failed_indexes)
+        if trace.trace_id:
+            result['trace_id'] = trace.trace_id
+        return jsonify(result)
     
     except Exception as e:
         logger.exception("翻译过程中发生错误")
+        finish_request_trace(trace, status=500, error=str(e))
+        result = {'error': f'翻译处理失败: {str(e)}'}
+        if trace.trace_id:
+            result['trace_id'] = trace.trace_id
+        return jsonify(result), 500
+
+@bp.route('/translate/document', methods=['POST'])
+def translate_document():
+    """
+    大文档翻译: 接受multipart文件上传(字段名file)或直接以请求体上传文本,
+    以流式响应返回译文,响应头X-Document-Id可用于之后重新下载
+    """
+    arrived_at = time.time()
+    purge_documents()
+    try:
+        params = request.form if request.mimetype == 'multipart/form-data' else request.args
+        temperature = float(params.get('temperature', DEFAULT_TEMPERATURE))
+        model = params.get('model', DEFAULT_MODEL)
+        
+        # 使用服务器端API密钥
+        api_key = DEFAULT_API_KEY
+        
+        # 大文档的并发受窗口限制, 按窗口大小做准入判断
+        chunk_scheduler.admit(BATCH, LARGE_DOC_WINDOW)
+        
+        upload_path = save_upload_to_temp()
+        if upload_path is None:
+            return jsonify({'error': '请提供要翻译的文件'}), 400
+    except AdmissionRejected as exc:
+        logger.warning(f"准入控制拒绝大文档: {exc}")
+        return admission_rejected_response(exc)
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'文件大小超过限制（最大 {LARGE_DOC_MAX_BYTES / (1024 * 1024):.3g}MB）'}), 413
+    except Exception as e:
+        logger.exception("接收上传文件时发生错误")
         return jsonify({'error': f'翻译处理失败: {str(e)}'}), 500
+    
+    doc_id = uuid.uuid4().hex
+    client = get_client_id()
+    output_path = os.path.join(documents_dir, f"{doc_id}.md")
+    upload_size = os.path.getsize(upload_path)
+    logger.info(f"大文档 {doc_id}: 上传大小 {upload_size} 字节")
+    if CAPTURE_PATH:
+        record_request_shape({
+            'ts': arrived_at,
+            'endpoint': '/translate/document',
+            'chars': upload_size,
+            'model': model,
+            'temperature': temperature,
+            'priority': BATCH,
+            'client': anonymize(client)
+        })
+    
+    def generate():
+        try:
+            with open(upload_path, 'r', encoding='utf-8', errors='replace', newline='') as lines:
+                yield from translate_document_stream(lines, api_key, model, temperature, output_path,
+                                                     client=client, document=doc_id)
+        except Exception as e:
+            logger.exception(f"大文档 {doc_id} 翻译过程中发生错误")
+            # 响应头已经发出, 在流末尾写入错误说明, 避免客户端把截断的译文当作完整结果
+            yield f"\n\n[翻译中断: {str(e)}]\n"
+        finally:
+            os.remove(upload_path)
+    
+    return Response(generate(), mimetype='text/markdown; charset=utf-8',
+                    headers={'X-Document-Id': doc_id})
+
+@bp.route('/documents/<doc_id>')
+def get_document(doc_id):
+    """
+    下载已完成的大文档译文, 含失败块的段落组替换为台账中的当前版本(包含后台已修复的块)
+    """
+    if not DOC_ID_RE.match(doc_id):
+        return jsonify({'error': '无效的文档ID'}), 400
+    
+    output_path = os.path.join(documents_dir, f"{doc_id}.md")
+    purge_documents()
+    if os.path.exists(output_path) and time.time() - os.path.getmtime(output_path) > DOCUMENT_RETENTION:
+        # 台账中的修复记录可能已被清理, 不再返回该译文
+        return jsonify({'error': '文档已过期,请重新上传'}), 410
+    if os.path.exists(output_path):
+        try:
+            segments = failure_ledger.get_segments(doc_id)
+        except Exception:
+            logger.exception("读取失败块台账时发生错误")
+            segments = []
+        if not segments:
+            return send_file(output_path, mimetype='text/markdown; charset=utf-8',
+                             as_attachment=True, download_name=f"{doc_id}.md")
+        return Response(iter_repaired_document(output_path, segments), mimetype='text/markdown; charset=utf-8',
+                        headers={
+                            'Content-Disposition': f'attachment; filename={doc_id}.md',
+                            'X-Pending-Repairs': str(sum(segment['pending'] for segment in segments)),
+                            'X-Repaired': str(sum(segment['repaired'] for segment in segments)),
+                            'X-Abandoned': str(sum(segment['abandoned'] for segment in segments))
+                        })
+    failed_path = output_path + '.failed'
+    if os.path.exists(failed_path):
+        try:
+            with open(failed_path, 'r', encoding='utf-8') as f:
+                reason = json.load(f).get('error', '')
+        except Exception:
+            reason = ''
+        return jsonify({'error': f'文档翻译已中断,请重新上传: {reason}'}), 410
+    partial_path = output_path + '.part'
+    if os.path.exists(partial_path):
+        if time.time() - os.path.getmtime(partial_path) > LARGE_DOC_STALE_SECONDS:
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            return jsonify({'error': '文档翻译已中断,请重新上传'}), 410
+        return jsonify({'error': '文档仍在翻译中'}), 409
+    return jsonify({'error': '文档不存在'}), 404
 
-@app.route('/favicon.ico')
+@bp.route('/translations/<doc_id>')
+def get_translation(doc_id):
+    """
+    获取含失败块的文档的当前版本(包含后台已修复的块)
+    """
+    if not DOC_ID_RE.match(doc_id):
+        return jsonify({'error': '无效的文档ID'}), 400
+    
+    try:
+        document = failure_ledger.get_document(doc_id)
+    except Exception as e:
+        logger.exception("读取失败块台账时发生错误")
+        return jsonify({'error': f'读取文档失败: {str(e)}'}), 500
+    if document is None:
+        return jsonify({'error': '文档不存在'}), 404
+    
+    results = document['results']
+    translated_content = '\n'.join(results)
+    final_translated = MarkdownElementHandler().restore_elements(translated_content, document['elements_map'])
+    translation_errors = sum(1 for chunk in results if '[翻译' in chunk)
+    success_rate = (len(results) - translation_errors) / len(results) * 100 if results else 0
+    
+    return jsonify({
+        'translated_text': final_translated,
+        'version': document['version'],
+        'chunks': len(results),
+        'success_rate': success_rate,
+        'pending_repairs': document['pending'],
+        'repaired': document['repaired'],
+        'abandoned': document['abandoned']
+    })
+
+@bp.route('/traces/<trace_id>')
+def get_trace(trace_id):
+    """
+    下载请求追踪(Chrome trace格式)
+    """
+    if not DOC_ID_RE.match(trace_id):
+        return jsonify({'error': '无效的追踪ID'}), 400
+    
+    trace_path = os.path.join(traces_dir, f"{trace_id}.json")
+    if not os.path.exists(trace_path):
+        return jsonify({'error': '追踪不存在'}), 404
+    return send_file(trace_path, mimetype='application/json')
+
+@bp.route('/stats')
+def stats():
+    """
+    返回调度器和缓存的累计统计,供压测与回放工具使用
+    统计只属于处理该请求的worker进程, pid 用于判断两次读取是否来自同一进程
+    """
+    with _stats_lock:
+        cache = dict(_cache_stats)
+    return jsonify({
+        'pid': os.getpid(),
+        'scheduler': chunk_scheduler.stats(),
+        'planner': chunk_planner.stats(),
+        'cache': cache
+    })
+
+@bp.route('/favicon.ico')
 def favicon():
-    return app.send_static_file('favicon.svg')
+    return current_app.send_static_file('favicon.svg')
+
+def create_app():
+    """
+    应用工厂: 只创建Flask应用并注册路由,不做磁盘写入和重量级导入
+    """
+    flask_app = Flask(__name__, static_folder=static_dir)
+    flask_app.config['MAX_CONTENT_LENGTH'] = LARGE_DOC_MAX_BYTES
+    CORS(flask_app)
+    flask_app.register_blueprint(bp)
+    return flask_app
+
+# 兼容 `gunicorn app:app` 与 `python app.py`
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=8080)
\ No newline at end of file
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+启动耗时基准测试
+
+在全新的子进程中测量:
+  1. import app 的耗时
+  2. 从导入到首个请求 (GET /) 返回的耗时
+并检查导入过程是否加载了 openai SDK 或写入了 static/cache 目录。
+
+用法:
+    python benchmarks/bench_startup.py -n 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行的探测脚本, 结果以JSON打印到stdout
+PROBE = r'''
+import json, os, sys, time
+root = sys.argv[1]
+sys.path.insert(0, root)
+watched = [os.path.join(root, 'static', name) for name in os.listdir(os.path.join(root, 'static'))]
+mtimes = {path: os.stat(path).st_mtime_ns for path in watched}
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+status = app.app.test_client().get('/').status_code
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'first_request_ms': (t2 - t0) * 1000,
+    'status': status,
+    'openai_loaded': 'openai' in sys.modules,
+    'static_rewritten': any(os.stat(p).st_mtime_ns != m for p, m in mtimes.items()),
+}))
+'''
+
+
+def run_once():
+    """在新的解释器中运行一次探测"""
+    output = subprocess.check_output([sys.executable, '-c', PROBE, ROOT], cwd=ROOT, stderr=subprocess.DEVNULL)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def summarize(values):
+    """计算中位数和p95"""
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return statistics.median(ordered), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description='测量应用启动耗时')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='运行次数（默认10）')
+    args = parser.parse_args()
+
+    samples = [run_once() for _ in range(args.runs)]
+
+    import_median, import_p95 = summarize([s['import_ms'] for s in samples])
+    first_median, first_p95 = summarize([s['first_request_ms'] for s in samples])
+
+    print(f"运行次数: {args.runs}")
+    print(f"import app:  中位数 {import_median:.1f} ms, p95 {import_p95:.1f} ms")
+    print(f"首个请求:    中位数 {first_median:.1f} ms, p95 {first_p95:.1f} ms")
+    print(f"导入时加载openai: {any(s['openai_loaded'] for s in samples)}")
+    print(f"导入时改写static: {any(s['static_rewritten'] for s in samples)}")
+
+    if any(s['status'] != 200 for s in samples):
+        print("警告: 首个请求未返回200")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+本地 OpenAI 接口桩
+
+实现 /v1/chat/completions, 把用户消息中的待翻译文本原样返回,
+并按 "固定延迟 + 字符数 / 吞吐" 模拟上游耗时, 可按比例注入错误。
+
+用法:
+    python benchmarks/openai_stub.py --port 8765 --latency 0.5 --chars-per-second 400
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+USER_PREFIX = "以下是需要翻译的文章:\n\n"
+
+
+class StubConfig:
+    def __init__(self, latency=0.5, chars_per_second=400.0, error_rate=0.0):
+        self.latency = latency
+        self.chars_per_second = chars_per_second
+        self.error_rate = error_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self._send_json(404, {'error': {'message': 'not found'}})
+                return
+
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            with config.lock:
+                config.requests += 1
+
+            messages = payload.get('messages', [])
+            text = messages[-1].get('content', '') if messages else ''
+            if text.startswith(USER_PREFIX):
+                text = text[len(USER_PREFIX):]
+
+            time.sleep(config.latency + len(text) / config.chars_per_second)
+
+            if random.random() < config.error_rate:
+                self._send_json(503, {'error': {'message': 'stub injected error', 'type': 'server_error'}})
+                return
+
+            prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4
+            completion_tokens = len(text) // 4
+            self._send_json(200, {
+                'id': f"chatcmpl-stub-{config.requests}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': payload.get('model', 'stub'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': text},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens
+                }
+            })
+
+    return StubHandler
+
+
+def start_stub(host='127.0.0.1', port=0, config=None):
+    """在后台线程启动桩服务, 返回 (server, base_url)"""
+    config = config or StubConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 OpenAI 接口桩')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help='每次调用的固定延迟（秒）')
+    parser.add_argument('--chars-per-second', type=float, default=400.0, help='模拟的输出吞吐（字符/秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='注入错误的比例（0~1）')
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency, args.chars_per_second, args.error_rate)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"OpenAI 桩已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+分块规划扫描
+
+用不同的上游延迟画像 (固定开销、吞吐、抖动) 训练规划器, 对不同长度的文本做规划,
+打印每种组合选中的块大小上限和块数, 并检查:
+  1. 同一画像下重复规划同一文本, 切分结果完全相同 (块缓存可以命中)
+  2. 至少有一种文本长度, 不同的延迟画像选出了不同的切分 (延迟确实影响决策)
+任一检查不通过时以非零状态退出。
+
+用法:
+    python benchmarks/plan_sweep.py
+    MAX_WORKERS=8 python benchmarks/plan_sweep.py --lengths 3000 12000 48000
+"""
+
+import argparse
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app as translator  # noqa: E402
+from planner import ChunkPlanner  # noqa: E402
+
+# (名称, 固定开销秒数, 字符/秒, 抖动秒数)
+PROFILES = (
+    ('slow-model', 1.0, 40.0, 0.3),
+    ('default', 2.0, 80.0, 0.5),
+    ('fast-model', 1.5, 2000.0, 0.2),
+    ('high-overhead', 12.0, 400.0, 0.5),
+    ('jittery', 1.0, 200.0, 8.0),
+)
+
+
+def synthesize_text(length, seed=0):
+    """生成指定长度、由长短不一的段落和标题组成的Markdown文本"""
+    rng = random.Random(seed)
+    words = ('model', 'token', 'layer', 'training', 'inference', 'vector', 'attention', 'prompt')
+    paragraphs = []
+    size = 0
+    while size < length:
+        if rng.random() < 0.1:
+            text = f"## Section {len(paragraphs)}"
+        else:
+            text = ' '.join(rng.choice(words) for _ in range(rng.randint(20, 120))) + '.'
+        paragraphs.append(text)
+        size += len(text) + 2
+    return '\n\n'.join(paragraphs)
+
+
+def train(planner, model, overhead, chars_per_second, jitter, seed=0):
+    """按延迟画像生成上游调用样本"""
+    rng = random.Random(seed)
+    for _ in range(60):
+        chars = rng.randint(300, 4000)
+        seconds = max(0.05, overhead + chars / chars_per_second + rng.gauss(0, jitter))
+        planner.observe(model, chars, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按不同延迟画像扫描分块规划')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[2500, 6000, 12000, 24000, 48000])
+    args = parser.parse_args()
+
+    scheduler = translator.chunk_scheduler
+    planner = ChunkPlanner(translator.MIN_CHUNK_SIZE, translator.MAX_CHUNK_SIZE,
+                           scheduler.max_in_flight_per_document, scheduler.workers)
+    for name, overhead, chars_per_second, jitter in PROFILES:
+        train(planner, name, overhead, chars_per_second, jitter)
+
+    print(f"文档并发上限 {planner.concurrency}, 线程池 {planner.pool_size}, 候选上限 {planner.candidate_sizes()}")
+    print(f"{'长度':>8} {'画像':<15} {'上限':>6} {'块数':>4} {'预计秒数':>8}")
+
+    ok = True
+    varied = False
+    for length in args.lengths:
+        text = synthesize_text(length)
+
+        def split(size):
+            return translator.split_text_into_chunks(text, max_chunk_size=size)
+
+        plans = set()
+        for name, *_ in PROFILES:
+            chunks, size, seconds = planner.plan(name, split)
+            if planner.plan(name, split)[0] != chunks:
+                print(f"同一文本两次规划结果不同: 长度 {length}, 画像 {name}")
+                ok = False
+            plans.add(size)
+            print(f"{len(text):>8} {name:<15} {size:>6} {len(chunks):>4} {seconds:>8.1f}")
+        varied = varied or len(plans) > 1
+
+    if not varied:
+        print("所有延迟画像都选出了相同的切分")
+        ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
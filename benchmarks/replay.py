@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+流量回放工具
+
+读取服务端以 CAPTURE_PATH 录制的请求形态 (JSONL), 按原始或缩放后的到达时间
+重新生成同样形态的 Markdown 文本并发送给翻译服务, 统计吞吐、延迟分位数、
+缓存命中率和排队延迟。
+
+默认在进程内启动翻译服务和本地 OpenAI 桩, 环境变量 (MAX_WORKERS、CHUNK_SIZE、
+SCHEDULER_* 等) 会直接作用于被测服务:
+    MAX_WORKERS=8 python benchmarks/replay.py capture.jsonl --speed 2
+
+也可以回放到一个已经运行、并已指向 OpenAI 桩的服务:
+    GUNICORN_WORKERS=1 gunicorn -c gunicorn.conf.py app:app
+    python benchmarks/replay.py capture.jsonl --url http://127.0.0.1:8080
+/stats 只统计单个 worker 进程, 缓存命中率和排队延迟需要服务只运行一个进程;
+前后两次读取来自不同进程时不输出这两项。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_stub import StubConfig, start_stub  # noqa: E402
+
+WORDS = ('model', 'token', 'layer', 'training', 'inference', 'vector', 'attention', 'prompt',
+         'dataset', 'gradient', 'latency', 'cache', 'batch', 'weight', 'output', 'context')
+
+# 各类被保护元素的生成方式, 键与 count_elements 的统计名称一致
+ELEMENT_TEMPLATES = {
+    'code_block': lambda rng, i: f"```python\nresult_{i} = compute({rng.randint(0, 99)})\n```",
+    'table': lambda rng, i: f"| name | value |\n| --- | --- |\n| item{i} | {rng.randint(0, 999)} |\n",
+    'img': lambda rng, i: f"![figure {i}](https://example.com/img/{i}.png)",
+    'url': lambda rng, i: f"[see {rng.choice(WORDS)}](https://example.com/doc/{i})",
+    'inline_code': lambda rng, i: f"`var_{i}`",
+    'latex_block': lambda rng, i: f"$$\nx_{i} = {rng.randint(1, 9)}y\n$$",
+    'latex_inline': lambda rng, i: f"$a_{i}$",
+    'html_tag': lambda rng, i: f"<span>tag {i}</span>",
+}
+BLOCK_ELEMENTS = {'code_block', 'table', 'latex_block'}
+
+
+def load_shapes(path, limit=None):
+    """读取录制文件, 按到达时间排序"""
+    shapes = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                shapes.append(json.loads(line))
+    shapes.sort(key=lambda s: s['ts'])
+    return shapes[:limit] if limit else shapes
+
+
+def synthesize_text(shape):
+    """
+    按请求形态生成Markdown文本; 相同fingerprint生成相同文本, 以保留缓存命中的特征
+    """
+    rng = random.Random(shape.get('fingerprint') or random.random())
+    inline, blocks = [], []
+    for name, count in (shape.get('elements') or {}).items():
+        template = ELEMENT_TEMPLATES.get(name)
+        if template is None:
+            continue
+        target = blocks if name in BLOCK_ELEMENTS else inline
+        target.extend(template(rng, i) for i in range(count))
+    rng.shuffle(inline)
+
+    target_chars = max(1, int(shape.get('chars', 0)))
+    headings = int(shape.get('headings', 0))
+    paragraphs = []
+    size = 0
+    while size < target_chars or inline or blocks or headings:
+        if headings and rng.random() < 0.2:
+            text = f"## {rng.choice(WORDS).title()} {rng.choice(WORDS)}"
+            headings -= 1
+        elif blocks and rng.random() < 0.3:
+            text = blocks.pop()
+        else:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(30, 80))]
+            for _ in range(min(len(inline), rng.randint(0, 3))):
+                words.insert(rng.randrange(len(words)), inline.pop())
+            text = ' '.join(words).capitalize() + '.'
+        paragraphs.append(text)
+        size += len(text) + 2
+    return '\n\n'.join(paragraphs)
+
+
+def send_shape(base_url, shape):
+    """回放一个请求, 返回 (状态码, 耗时秒数)"""
+    text = synthesize_text(shape)
+    headers = {'X-Client-Id': shape.get('client', 'replay')}
+    started = time.perf_counter()
+    try:
+        if shape.get('endpoint') == '/translate/document':
+            query = f"?model={shape.get('model', '')}&temperature={shape.get('temperature', 0.1)}"
+            req = urllib.request.Request(f"{base_url}/translate/document{query}", data=text.encode('utf-8'),
+                                         headers={**headers, 'Content-Type': 'text/markdown'})
+        else:
+            payload = {'text': text, 'model': shape.get('model'), 'temperature': shape.get('temperature')}
+            if shape.get('priority') == 'batch':
+                payload['priority'] = 'batch'
+            req = urllib.request.Request(f"{base_url}/translate", data=json.dumps(payload).encode('utf-8'),
+                                         headers={**headers, 'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=3600) as resp:
+            while resp.read(64 * 1024):
+                pass
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - started
+
+
+def start_local_server(args):
+    """在进程内启动OpenAI桩和翻译服务, 返回服务地址"""
+    _, stub_url = start_stub(config=StubConfig(args.latency, args.chars_per_second, args.error_rate))
+    os.environ['OPENAI_BASE_URL'] = stub_url
+    os.environ.setdefault('OPENAI_API_KEY', 'stub')
+    os.environ['CACHE_DIR'] = args.cache_dir or tempfile.mkdtemp(prefix='mdfanyi_replay_')
+
+    sys.path.insert(0, ROOT)
+    import logging
+    import app as translator
+    from werkzeug.serving import make_server
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, translator.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def fetch_stats(base_url):
+    """读取服务端累计统计, 服务不支持时返回None"""
+    try:
+        with urllib.request.urlopen(f"{base_url}/stats", timeout=30) as resp:
+            return json.loads(resp.read())
+    except Exception:
+        return None
+
+
+def report(results, wall, before, after, shapes):
+    """打印回放结果"""
+    statuses = Counter(status for status, _ in results)
+    latencies = [elapsed for status, elapsed in results if status == 200]
+    total_chars = sum(int(s.get('chars', 0)) for s in shapes)
+
+    print(f"请求数: {len(results)}  耗时: {wall:.1f} 秒")
+    print(f"状态码: {dict(sorted(statuses.items()))}")
+    print(f"吞吐: {len(results) / wall:.2f} 请求/秒, {total_chars / wall:.0f} 字符/秒")
+    print(f"延迟(成功请求): p50 {percentile(latencies, 50):.2f}s  p90 {percentile(latencies, 90):.2f}s  "
+          f"p99 {percentile(latencies, 99):.2f}s  max {max(latencies, default=0):.2f}s")
+
+    if before and after and before.get('pid') != after.get('pid'):
+        print("两次读取 /stats 来自不同的 worker 进程, 不输出缓存命中率和排队延迟 (请用 GUNICORN_WORKERS=1 启动服务)")
+    elif before and after:
+        hits = after['cache']['hits'] - before['cache']['hits']
+        misses = after['cache']['misses'] - before['cache']['misses']
+        print(f"缓存命中率: {hits / (hits + misses) * 100 if hits + misses else 0:.1f}% ({hits}/{hits + misses})")
+        for priority, total in after['scheduler']['queue_wait_total_seconds'].items():
+            waited = total - before['scheduler']['queue_wait_total_seconds'].get(priority, 0)
+            count = after['scheduler']['dequeued'][priority] - before['scheduler']['dequeued'].get(priority, 0)
+            if count:
+                print(f"平均排队延迟[{priority}]: {waited / count:.2f}s ({count} 个块)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回放录制的翻译请求')
+    parser.add_argument('capture', help='CAPTURE_PATH 录制的 JSONL 文件')
+    parser.add_argument('--speed', type=float, default=1.0, help='回放速度倍数（默认按原速）')
+    parser.add_argument('--limit', type=int, help='只回放前 N 个请求')
+    parser.add_argument('--url', help='回放到已运行的服务，而不是在进程内启动')
+    parser.add_argument('--cache-dir', help='进程内服务使用的缓存目录（默认使用新的临时目录）')
+    parser.add_argument('--latency', type=float, default=0.5, help='OpenAI 桩的固定延迟（秒）')
+    parser.add_argument('--chars-per-second', type=float, default=400.0, help='OpenAI 桩的吞吐（字符/秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='OpenAI 桩注入错误的比例')
+    args = parser.parse_args()
+
+    shapes = load_shapes(args.capture, args.limit)
+    if not shapes:
+        print("录制文件为空")
+        return
+
+    base_url = args.url.rstrip('/') if args.url else start_local_server(args)
+    before = fetch_stats(base_url)
+
+    results = []
+    lock = threading.Lock()
+
+    def run(shape):
+        outcome = send_shape(base_url, shape)
+        with lock:
+            results.append(outcome)
+
+    threads = []
+    first_ts = shapes[0]['ts']
+    started = time.perf_counter()
+    for shape in shapes:
+        delay = (shape['ts'] - first_ts) / args.speed - (time.perf_counter() - started)
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=run, args=(shape,), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    report(results, wall, before, fetch_stats(base_url), shapes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+gunicorn 配置
+
+所有参数都可以通过环境变量覆盖, 例如:
+    GUNICORN_WORKERS=4 GUNICORN_THREADS=8 gunicorn -c gunicorn.conf.py app:app
+"""
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# 翻译请求大部分时间在等待上游API, 使用线程型worker, 少量进程 + 多线程即可
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count(), 2)))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# 每个worker进程有各自的翻译块调度器, 告知应用进程数, 以便按进程平分上游并发总数
+os.environ.setdefault('SCHEDULER_PROCESSES', str(workers))
+
+# 在master中预加载应用, worker通过fork共享已导入的模块和预编译的正则
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# gthread worker 的心跳由主线程发送, 与请求耗时无关, timeout 只用于检测卡死的worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# 重启worker时等待进行中请求的最长秒数, 超时后worker退出, 仍在进行的长文档流式翻译会被中断
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 300))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# 按请求数回收worker, 默认关闭: 回收会在 graceful_timeout 后中断仍在进行的长文档翻译
+# 开启时抖动避免所有worker同时重启
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def when_ready(server):
+    # 预加载完成后冻结GC追踪的对象, 避免worker中的GC写入共享页面破坏写时复制
+    if preload_app:
+        gc.collect()
+        gc.freeze()
@@ -0,0 +1,388 @@
+"""
+翻译失败块台账与后台修复
+
+重试耗尽仍失败的块会连同所在文档的其余译文一起写入 SQLite 台账。
+后台修复线程在上游恢复健康后按指数退避重新翻译这些块,
+成功后更新文档译文并递增版本号, 用户无需重新提交整篇文档。
+多个 gunicorn worker 共享同一个台账文件, 通过租约避免重复修复同一个块。
+
+大文档按段落组记录: 每个含失败块的段落组作为一篇独立的台账文档, 并记录它在译文文件中的
+字节偏移和长度, 下载时用修复后的段落组替换文件中对应的区间。
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+REPAIRED = 'repaired'
+ABANDONED = 'abandoned'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    temperature REAL NOT NULL,
+    elements_map TEXT NOT NULL,
+    results TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS failures (
+    doc_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    chunk TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    PRIMARY KEY (doc_id, chunk_index)
+);
+CREATE INDEX IF NOT EXISTS failures_due ON failures (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS document_segments (
+    doc_id TEXT NOT NULL,
+    segment_index INTEGER NOT NULL,
+    ledger_id TEXT NOT NULL,
+    output_offset INTEGER NOT NULL,
+    output_length INTEGER NOT NULL,
+    PRIMARY KEY (doc_id, segment_index)
+);
+"""
+
+
+class FailureLedger:
+    def __init__(self, path, max_attempts=8, base_backoff=30.0, max_backoff=3600.0, lease_seconds=300.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        # 每次操作使用独立连接, 可以在多个线程和进程间安全使用
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    conn = sqlite3.connect(self.path, timeout=30)
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(SCHEMA)
+                    conn.close()
+                    self._initialized = True
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def backoff(self, attempts):
+        return min(self.max_backoff, self.base_backoff * 2 ** max(0, attempts - 1))
+
+    def _insert_document(self, conn, doc_id, model, temperature, elements_map, chunks, results, failed_indexes, now):
+        conn.execute(
+            'INSERT OR REPLACE INTO documents (doc_id, model, temperature, elements_map, results, version, '
+            'created_at, updated_at) VALUES (?, ?, ?, ?, ?, 1, ?, ?)',
+            (doc_id, model, temperature, json.dumps(elements_map, ensure_ascii=False),
+             json.dumps(results, ensure_ascii=False), now, now)
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO failures (doc_id, chunk_index, chunk, status, attempts, next_attempt_at) '
+            'VALUES (?, ?, ?, ?, 0, ?)',
+            [(doc_id, index, chunks[index], PENDING, now + self.base_backoff) for index in failed_indexes]
+        )
+
+    def record_document(self, doc_id, model, temperature, elements_map, chunks, results, failed_indexes):
+        """记录一篇含失败块的文档"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            self._insert_document(conn, doc_id, model, temperature, elements_map, chunks, results,
+                                  failed_indexes, now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def record_segments(self, doc_id, model, temperature, segments):
+        """
+        记录大文档中含失败块的段落组
+        segments: [{'index', 'offset', 'length', 'elements_map', 'chunks', 'results', 'failed_indexes'}],
+        offset/length 为该段落组译文在输出文件中的字节区间
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for segment in segments:
+                ledger_id = f"{doc_id}-{segment['index']}"
+                self._insert_document(conn, ledger_id, model, temperature, segment['elements_map'],
+                                      segment['chunks'], segment['results'], segment['failed_indexes'], now)
+                conn.execute(
+                    'INSERT OR REPLACE INTO document_segments (doc_id, segment_index, ledger_id, output_offset, '
+                    'output_length) VALUES (?, ?, ?, ?, ?)',
+                    (doc_id, segment['index'], ledger_id, segment['offset'], segment['length'])
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def delete_segments(self, doc_id):
+        """删除大文档记录过的所有段落组及其失败块(翻译中断、译文不会发布时使用)"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            subquery = 'SELECT ledger_id FROM document_segments WHERE doc_id = ?'
+            conn.execute(f'DELETE FROM failures WHERE doc_id IN ({subquery})', (doc_id,))
+            conn.execute(f'DELETE FROM documents WHERE doc_id IN ({subquery})', (doc_id,))
+            conn.execute('DELETE FROM document_segments WHERE doc_id = ?', (doc_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def claim_due(self, limit):
+        """
+        领取到期的失败块并加租约, 返回 [(doc_id, chunk_index, chunk, model, temperature, attempts)]
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                'SELECT f.doc_id, f.chunk_index, f.chunk, d.model, d.temperature, f.attempts '
+                'FROM failures f JOIN documents d ON d.doc_id = f.doc_id '
+                'WHERE f.status = ? AND f.next_attempt_at <= ? AND f.lease_until <= ? '
+                'ORDER BY f.next_attempt_at LIMIT ?',
+                (PENDING, now, now, limit)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE failures SET lease_until = ? WHERE doc_id = ? AND chunk_index = ?',
+                [(now + self.lease_seconds, row[0], row[1]) for row in rows]
+            )
+            conn.execute('COMMIT')
+            return rows
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def mark_repaired(self, doc_id, chunk_index, translated):
+        """写入修复后的译文并递增文档版本"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT results FROM documents WHERE doc_id = ?', (doc_id,)).fetchone()
+            if row is not None:
+                results = json.loads(row[0])
+                results[chunk_index] = translated
+                conn.execute(
+                    'UPDATE documents SET results = ?, version = version + 1, updated_at = ? WHERE doc_id = ?',
+                    (json.dumps(results, ensure_ascii=False), time.time(), doc_id)
+                )
+            conn.execute(
+                'UPDATE failures SET status = ?, attempts = attempts + 1, lease_until = 0 '
+                'WHERE doc_id = ? AND chunk_index = ?',
+                (REPAIRED, doc_id, chunk_index)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def release(self, doc_id, chunk_index):
+        """释放未处理的租约, 下一轮可以重新领取"""
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE failures SET lease_until = 0 WHERE doc_id = ? AND chunk_index = ?',
+                         (doc_id, chunk_index))
+        finally:
+            conn.close()
+
+    def mark_failed(self, doc_id, chunk_index, attempts, error):
+        """记录一次修复失败, 超过最大次数后放弃"""
+        attempts += 1
+        status = ABANDONED if attempts >= self.max_attempts else PENDING
+        conn = self._connect()
+        try:
+            conn.execute(
+                'UPDATE failures SET status = ?, attempts = ?, next_attempt_at = ?, lease_until = 0, last_error = ? '
+                'WHERE doc_id = ? AND chunk_index = ?',
+                (status, attempts, time.time() + self.backoff(attempts), error, doc_id, chunk_index)
+            )
+        finally:
+            conn.close()
+
+    def get_document(self, doc_id):
+        """读取文档当前版本, 不存在时返回None"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT model, temperature, elements_map, results, version, updated_at FROM documents WHERE doc_id = ?',
+                (doc_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = dict(conn.execute(
+                'SELECT status, COUNT(*) FROM failures WHERE doc_id = ? GROUP BY status', (doc_id,)
+            ).fetchall())
+        finally:
+            conn.close()
+
+        return {
+            'model': row[0],
+            'temperature': row[1],
+            'elements_map': json.loads(row[2]),
+            'results': json.loads(row[3]),
+            'version': row[4],
+            'updated_at': row[5],
+            'pending': counts.get(PENDING, 0),
+            'repaired': counts.get(REPAIRED, 0),
+            'abandoned': counts.get(ABANDONED, 0),
+        }
+
+    def get_segments(self, doc_id):
+        """读取大文档中记录过失败块的段落组的当前版本, 按输出偏移排序"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                'SELECT s.ledger_id, s.output_offset, s.output_length, d.elements_map, d.results, d.version '
+                'FROM document_segments s JOIN documents d ON d.doc_id = s.ledger_id '
+                'WHERE s.doc_id = ? ORDER BY s.output_offset',
+                (doc_id,)
+            ).fetchall()
+            counts = {}
+            for ledger_id, status, count in conn.execute(
+                'SELECT f.doc_id, f.status, COUNT(*) FROM failures f '
+                'JOIN document_segments s ON s.ledger_id = f.doc_id WHERE s.doc_id = ? GROUP BY f.doc_id, f.status',
+                (doc_id,)
+            ).fetchall():
+                counts.setdefault(ledger_id, {})[status] = count
+        finally:
+            conn.close()
+
+        return [{
+            'offset': row[1],
+            'length': row[2],
+            'elements_map': json.loads(row[3]),
+            'results': json.loads(row[4]),
+            'version': row[5],
+            'pending': counts.get(row[0], {}).get(PENDING, 0),
+            'repaired': counts.get(row[0], {}).get(REPAIRED, 0),
+            'abandoned': counts.get(row[0], {}).get(ABANDONED, 0),
+        } for row in rows]
+
+    def purge(self, older_than):
+        """删除早于 older_than 秒之前创建的文档记录"""
+        cutoff = time.time() - older_than
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM failures WHERE doc_id IN (SELECT doc_id FROM documents WHERE created_at < ?)',
+                         (cutoff,))
+            conn.execute('DELETE FROM documents WHERE created_at < ?', (cutoff,))
+            conn.execute('DELETE FROM document_segments WHERE ledger_id NOT IN (SELECT doc_id FROM documents)')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+
+class UpstreamHealth:
+    """根据最近的上游调用结果判断上游是否健康"""
+
+    def __init__(self, window=20, max_error_ratio=0.5):
+        self.max_error_ratio = max_error_ratio
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, ok):
+        with self._lock:
+            self._outcomes.append(bool(ok))
+
+    def healthy(self):
+        with self._lock:
+            if not self._outcomes:
+                return True
+            errors = self._outcomes.count(False)
+            return errors / len(self._outcomes) <= self.max_error_ratio
+
+
+class RepairWorker:
+    """
+    后台修复线程: 定期领取到期的失败块并重新翻译
+    上游不健康时, 每轮只取一个块作为探测, 避免在故障期间放大请求量
+    """
+
+    def __init__(self, ledger, health, repair_fn, interval=10.0, batch_size=8, retention=30 * 24 * 60 * 60):
+        self.ledger = ledger
+        self.health = health
+        self.repair_fn = repair_fn  # (chunk, model, temperature) -> (是否成功, 译文或错误信息)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retention = retention
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def ensure_started(self):
+        # fork 之后子进程中没有该线程, 按进程号判断是否需要重新启动
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='chunk-repair', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("后台修复失败块时发生错误")
+
+    def run_once(self):
+        """执行一轮修复, 返回本轮修复成功的块数"""
+        if time.time() - self._last_purge > 3600:
+            self.ledger.purge(self.retention)
+            self._last_purge = time.time()
+
+        limit = self.batch_size if self.health.healthy() else 1
+        repaired = 0
+        claimed = self.ledger.claim_due(limit)
+        for position, (doc_id, chunk_index, chunk, model, temperature, attempts) in enumerate(claimed):
+            ok, output = self.repair_fn(chunk, model, temperature)
+            if ok:
+                self.ledger.mark_repaired(doc_id, chunk_index, output)
+                repaired += 1
+                logger.info(f"已修复文档 {doc_id} 的第 {chunk_index} 块")
+            else:
+                self.ledger.mark_failed(doc_id, chunk_index, attempts, output)
+                logger.warning(f"修复文档 {doc_id} 的第 {chunk_index} 块失败 (第 {attempts + 1} 次): {output}")
+                # 上游仍有问题, 本轮不再继续, 释放其余块的租约
+                for rest in claimed[position + 1:]:
+                    self.ledger.release(rest[0], rest[1])
+                break
+        return repaired
@@ -0,0 +1,188 @@
+"""
+自适应分块规划
+
+块大小上限只从固定的阶梯 (MIN_CHUNK_SIZE 起每级乘以√2, 直到 MAX_CHUNK_SIZE) 中选择,
+按所选上限做均衡切分的结果只取决于文本本身, 同一文本在不同负载下得到相同的块, 不会错过块缓存。
+
+对每个候选上限实际切分文本, 用每个模型观测到的上游延迟 (固定开销 a、每字符耗时 b、
+残差标准差 σ) 估算代价, 选择代价最小的上限:
+
+    代价 = 模拟执行耗时 + σ × √(2 ln n) + n × a / 线程池大小
+
+  - 模拟执行耗时: 各块耗时 a + b × 块长度, 按文档并发上限分配到各个执行槽后的最长时间
+  - σ × √(2 ln n): n 块并行时最慢一块的期望额外延迟, 上游抖动越大, 拆得越细越吃亏
+  - n × a / 线程池大小: 每块的固定开销占用共享线程池, 折算为其他请求的平均排队时间
+
+固定开销大、吞吐高的模型倾向于少拆块, 每字符耗时高的模型倾向于多拆块以并行。
+"""
+
+import logging
+import math
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyModel:
+    """单个模型的延迟模型: 秒数 ≈ overhead + seconds_per_char × 字符数"""
+
+    def __init__(self, overhead, seconds_per_char, jitter, window=200):
+        self.prior_overhead = overhead
+        self.prior_seconds_per_char = seconds_per_char
+        self.prior_jitter = jitter
+        self.overhead = overhead
+        self.seconds_per_char = seconds_per_char
+        self.jitter = jitter
+        self._samples = deque(maxlen=window)  # (字符数, 秒数, 输出token数)
+
+    def observe(self, chars, seconds, completion_tokens=0):
+        self._samples.append((chars, seconds, completion_tokens))
+        self._fit()
+
+    def _fit(self):
+        """
+        对最近的样本做最小二乘拟合, 样本不足或字符数没有差异时只更新每字符耗时;
+        样本足够时用拟合残差的标准差作为抖动
+        """
+        n = len(self._samples)
+        xs = [s[0] for s in self._samples]
+        ys = [s[1] for s in self._samples]
+        mean_x = sum(xs) / n
+        mean_y = sum(ys) / n
+        var_x = sum((x - mean_x) ** 2 for x in xs)
+
+        fitted = False
+        if n >= 5 and var_x > 0:
+            slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+            if slope > 0:
+                self.seconds_per_char = slope
+                self.overhead = max(0.0, mean_y - slope * mean_x)
+                fitted = True
+
+        if not fitted:
+            self.overhead = min(self.prior_overhead, mean_y)
+            if mean_x > 0:
+                self.seconds_per_char = max(mean_y - self.overhead, 0.0) / mean_x or self.prior_seconds_per_char
+
+        if n >= 5:
+            residuals = [y - self.predict(x) for x, y in zip(xs, ys)]
+            self.jitter = math.sqrt(sum(r * r for r in residuals) / n)
+
+    def predict(self, chars):
+        return self.overhead + self.seconds_per_char * chars
+
+    def tokens_per_second(self):
+        seconds = sum(s[1] for s in self._samples)
+        tokens = sum(s[2] for s in self._samples)
+        return tokens / seconds if seconds > 0 else 0.0
+
+    def samples(self):
+        return len(self._samples)
+
+
+class ChunkPlanner:
+    def __init__(self, min_chunk_size, max_chunk_size, concurrency, pool_size,
+                 default_overhead=2.0, default_chars_per_second=80.0, default_jitter=0.5):
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.concurrency = max(1, concurrency)  # 单个文档同时运行的块数上限
+        self.pool_size = max(1, pool_size)  # 所有请求共享的线程数
+        self.default_overhead = default_overhead
+        self.default_seconds_per_char = 1.0 / default_chars_per_second
+        self.default_jitter = default_jitter
+        self._models = {}
+        self._prediction_error = {}  # 模型 -> 相对误差的滑动平均
+        self._last_outcome = {}
+        self._lock = threading.Lock()
+
+    def _parameters(self, model):
+        """没有观测记录的模型使用默认参数, 不为其创建条目(模型名来自客户端请求)"""
+        with self._lock:
+            latency_model = self._models.get(model)
+            if latency_model is None:
+                return self.default_overhead, self.default_seconds_per_char, self.default_jitter
+            return latency_model.overhead, latency_model.seconds_per_char, latency_model.jitter
+
+    def observe(self, model, chars, seconds, completion_tokens=0):
+        """记录一次上游调用的实际耗时, 只有上游调用成功过的模型才会有条目"""
+        with self._lock:
+            latency_model = self._models.get(model)
+            if latency_model is None:
+                latency_model = LatencyModel(self.default_overhead, self.default_seconds_per_char, self.default_jitter)
+                self._models[model] = latency_model
+            latency_model.observe(chars, seconds, completion_tokens)
+
+    def candidate_sizes(self):
+        """块大小上限的固定阶梯: 从最小值起每级乘以√2, 最后一级为最大值"""
+        sizes = []
+        size = float(self.min_chunk_size)
+        while size < self.max_chunk_size:
+            sizes.append(int(round(size)))
+            size *= math.sqrt(2)
+        sizes.append(self.max_chunk_size)
+        return sizes
+
+    def _estimate(self, parameters, chunk_sizes):
+        """返回 (预计耗时, 代价)"""
+        overhead, seconds_per_char, jitter = parameters
+        count = len(chunk_sizes)
+        if not count:
+            return 0.0, 0.0
+        slots = [0.0] * min(self.concurrency, count)
+        for size in chunk_sizes:
+            index = slots.index(min(slots))
+            slots[index] += overhead + seconds_per_char * size
+        seconds = max(slots) + jitter * math.sqrt(2 * math.log(count))
+        return seconds, seconds + count * overhead / self.pool_size
+
+    def predict(self, model, chunk_sizes):
+        """按实际块大小模拟并发执行, 返回预计的总耗时(秒)"""
+        return self._estimate(self._parameters(model), chunk_sizes)[0]
+
+    def plan(self, model, split):
+        """
+        依次用阶梯中的每个上限调用 split(上限) 切分文本, 选择代价最小的切分
+        代价相同时取更大的上限, 减少调用次数
+        返回: (块列表, 所选上限, 预计秒数)
+        """
+        parameters = self._parameters(model)
+        best = None
+        for size in self.candidate_sizes():
+            chunks = split(size)
+            seconds, cost = self._estimate(parameters, [len(chunk) for chunk in chunks])
+            if best is None or cost <= best[0] + 1e-9:
+                best = (cost, chunks, size, seconds)
+            # 更大的上限不会再减少块数
+            if len(chunks) <= 1:
+                break
+        _, chunks, size, seconds = best
+        return chunks, size, seconds
+
+    def record_outcome(self, model, predicted, actual):
+        """记录一次规划的预测值与实际值"""
+        if actual <= 0:
+            return
+        error = abs(predicted - actual) / actual
+        with self._lock:
+            if model not in self._models:
+                return
+            previous = self._prediction_error.get(model)
+            self._prediction_error[model] = error if previous is None else 0.8 * previous + 0.2 * error
+            self._last_outcome[model] = {'predicted_seconds': round(predicted, 3), 'actual_seconds': round(actual, 3)}
+
+    def stats(self):
+        """返回各模型的延迟模型和预测误差"""
+        with self._lock:
+            return {
+                model: {
+                    'samples': latency_model.samples(),
+                    'overhead_seconds': round(latency_model.overhead, 3),
+                    'jitter_seconds': round(latency_model.jitter, 3),
+                    'chars_per_second': round(1.0 / latency_model.seconds_per_char, 1) if latency_model.seconds_per_char else None,
+                    'tokens_per_second': round(latency_model.tokens_per_second(), 1),
+                    'prediction_error': round(self._prediction_error[model], 3) if model in self._prediction_error else None,
+                    'last': self._last_outcome.get(model),
+                }
+                for model, latency_model in self._models.items()
+            }
@@ -0,0 +1,232 @@
+"""
+翻译块调度器
+
+同一进程内所有请求的翻译块共享一个工作线程池, 按以下规则调度:
+  - 优先级: interactive 类始终先于 batch 类出队
+  - 同一优先级内, 按客户端做加权公平排队 (WFQ), 代价为块的字符数
+  - 每个文档同时运行的块数有上限, 单个大文档无法占满所有线程
+  - 入队前做准入控制, 预计排队时间超过延迟预算时拒绝, 并给出重试时间
+
+gunicorn 的每个 worker 进程各有一个调度器, 公平排队、文档并发上限和准入控制都只在进程内生效。
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, BATCH)
+
+
+class AdmissionRejected(Exception):
+    """排队时间超出延迟预算,请求被拒绝"""
+
+    def __init__(self, retry_after, estimated_wait):
+        super().__init__(f"预计排队 {estimated_wait:.1f} 秒,超出延迟预算")
+        self.retry_after = retry_after
+        self.estimated_wait = estimated_wait
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'future', 'client', 'priority', 'document', 'tag', 'enqueued_at')
+
+    def __init__(self, fn, args, future, client, priority, document, tag):
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.client = client
+        self.priority = priority
+        self.document = document
+        self.tag = tag
+        self.enqueued_at = time.monotonic()
+
+
+class ChunkScheduler:
+    def __init__(self, workers, max_in_flight_per_document, latency_budgets,
+                 client_weights=None, initial_service_time=5.0):
+        self.workers = workers
+        self.max_in_flight_per_document = max_in_flight_per_document
+        self.latency_budgets = latency_budgets
+        self.client_weights = client_weights or {}
+
+        self._cond = threading.Condition()
+        self._threads = []
+        # 每个优先级: {客户端: deque[_Job]}
+        self._queues = {priority: {} for priority in PRIORITIES}
+        self._queued = {priority: 0 for priority in PRIORITIES}
+        # WFQ 虚拟时间及每个客户端最后一个任务的完成标签
+        self._virtual_time = {priority: 0.0 for priority in PRIORITIES}
+        self._last_tag = {priority: {} for priority in PRIORITIES}
+        # 每个文档正在运行的块数
+        self._running_by_document = {}
+        self._running = 0
+
+        # 统计信息(指数滑动平均)
+        self._service_time = initial_service_time
+        self._queue_wait = {priority: 0.0 for priority in PRIORITIES}
+        self._queue_wait_total = {priority: 0.0 for priority in PRIORITIES}
+        self._dequeued = {priority: 0 for priority in PRIORITIES}
+        self._completed = 0
+        self._rejected = 0
+
+    def _ensure_started(self):
+        # 线程在第一次提交时才启动, 这样 gunicorn 预加载的 master 进程中不会有线程
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"chunk-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def estimate_wait(self, priority, chunks=1):
+        """估算新提交的 chunks 个块全部开始执行前需要等待的秒数"""
+        with self._cond:
+            ahead = self._queued[INTERACTIVE]
+            if priority == BATCH:
+                ahead += self._queued[BATCH]
+            busy = max(0, self._running + ahead + chunks - self.workers)
+            return busy * self._service_time / self.workers
+
+    def admit(self, priority, chunks=1):
+        """
+        准入控制: 预计排队时间超过该优先级的延迟预算时抛出 AdmissionRejected
+        """
+        estimated = self.estimate_wait(priority, chunks)
+        budget = self.latency_budgets[priority]
+        if estimated > budget:
+            with self._cond:
+                self._rejected += 1
+            retry_after = max(1, math.ceil(estimated - budget))
+            raise AdmissionRejected(retry_after, estimated)
+
+    def submit(self, fn, *args, client='anonymous', priority=BATCH, document=None):
+        """
+        提交一个翻译块, 返回 concurrent.futures.Future
+        """
+        future = Future()
+        with self._cond:
+            self._ensure_started()
+            weight = self.client_weights.get(client, 1.0)
+            cost = len(args[0]) if args and isinstance(args[0], str) else 1
+            start = max(self._virtual_time[priority], self._last_tag[priority].get(client, 0.0))
+            tag = start + cost / weight
+            self._last_tag[priority][client] = tag
+
+            job = _Job(fn, args, future, client, priority, document, tag)
+            self._queues[priority].setdefault(client, deque()).append(job)
+            self._queued[priority] += 1
+            self._cond.notify()
+        return future
+
+    def _pick(self):
+        """选出下一个可运行的任务, 没有时返回 None (调用时需持有锁)"""
+        for priority in PRIORITIES:
+            best = None
+            best_client = None
+            for client, queue in self._queues[priority].items():
+                # 每个客户端取第一个未达到文档并发上限的任务
+                for job in queue:
+                    if self._running_by_document.get(job.document, 0) < self.max_in_flight_per_document:
+                        if best is None or job.tag < best.tag:
+                            best = job
+                            best_client = client
+                        break
+            if best is not None:
+                queue = self._queues[priority][best_client]
+                queue.remove(best)
+                if not queue:
+                    # 空闲客户端不保留历史标签, 重新活跃时从当前虚拟时间开始
+                    del self._queues[priority][best_client]
+                    self._last_tag[priority].pop(best_client, None)
+                self._queued[priority] -= 1
+                self._virtual_time[priority] = max(self._virtual_time[priority], best.tag)
+                return best
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._pick()
+                while job is None:
+                    self._cond.wait()
+                    job = self._pick()
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                self._running += 1
+                self._running_by_document[job.document] = self._running_by_document.get(job.document, 0) + 1
+                wait = time.monotonic() - job.enqueued_at
+                self._queue_wait[job.priority] = 0.8 * self._queue_wait[job.priority] + 0.2 * wait
+                self._queue_wait_total[job.priority] += wait
+                self._dequeued[job.priority] += 1
+
+            started = time.monotonic()
+            try:
+                job.future.set_result(job.fn(*job.args))
+            except BaseException as exc:
+                job.future.set_exception(exc)
+            elapsed = time.monotonic() - started
+
+            with self._cond:
+                self._running -= 1
+                remaining = self._running_by_document[job.document] - 1
+                if remaining:
+                    self._running_by_document[job.document] = remaining
+                else:
+                    del self._running_by_document[job.document]
+                self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+                self._completed += 1
+                # 文档并发数下降后, 可能有被跳过的任务可以运行
+                self._cond.notify_all()
+
+    def stats(self):
+        """返回调度器当前状态"""
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': dict(self._queued),
+                'queue_wait_seconds': {p: round(w, 3) for p, w in self._queue_wait.items()},
+                'queue_wait_total_seconds': {p: round(w, 3) for p, w in self._queue_wait_total.items()},
+                'dequeued': dict(self._dequeued),
+                'service_time_seconds': round(self._service_time, 3),
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+
+def parse_client_weights(value):
+    """解析 "client_a:2,client_b:0.5" 格式的客户端权重"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        client, _, weight = item.rpartition(':')
+        try:
+            weights[client] = float(weight)
+        except ValueError:
+            logger.warning(f"忽略无效的客户端权重: {item}")
+    return weights
+
+
+def create_scheduler(max_workers):
+    """
+    根据环境变量创建调度器
+    SCHEDULER_WORKERS 是所有进程合计的上游并发数, 按 SCHEDULER_PROCESSES (gunicorn worker数) 平分到每个进程
+    """
+    processes = max(1, int(os.environ.get('SCHEDULER_PROCESSES', 1)))
+    workers = max(1, math.ceil(int(os.environ.get('SCHEDULER_WORKERS', max_workers * 4)) / processes))
+    max_in_flight = int(os.environ.get('SCHEDULER_MAX_IN_FLIGHT_PER_DOCUMENT', max_workers))
+    return ChunkScheduler(
+        workers=workers,
+        max_in_flight_per_document=max(1, min(max_in_flight, workers)),
+        latency_budgets={
+            INTERACTIVE: float(os.environ.get('SCHEDULER_INTERACTIVE_BUDGET', 15)),
+            BATCH: float(os.environ.get('SCHEDULER_BATCH_BUDGET', 600)),
+        },
+        client_weights=parse_client_weights(os.environ.get('SCHEDULER_CLIENT_WEIGHTS', '')),
+    )
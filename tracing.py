@@ -0,0 +1,235 @@
+"""
+按请求的追踪与采样分析
+
+开启追踪的请求会记录每个阶段和每个翻译块的耗时区间 (span), 包括缓存读写、
+排队等待、每次重试、上游调用及token数, 导出为 Chrome trace 格式的 JSON
+(可在 chrome://tracing 或 https://ui.perfetto.dev 中打开)。
+
+开启采样分析时, 后台线程定时采集参与该请求的线程的调用栈,
+以折叠栈格式 ("frame;frame;frame": 次数) 写入同一个 JSON 的 profile 字段,
+可直接用于 flamegraph.pl 或 speedscope。
+"""
+
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+REQUEST_LANE = 0
+CHUNK_LANE_BASE = 1000
+
+_local = threading.local()
+
+
+class RequestTrace:
+    def __init__(self, trace_id, profile=False, profile_interval=0.005):
+        self.trace_id = trace_id
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._pid = os.getpid()
+        self._events = []
+        self._lanes = {REQUEST_LANE: 'request'}
+        self.info = {}  # 请求结果等附加信息, 导出到 otherData
+        self._lock = threading.Lock()
+
+        # 采样分析
+        self._profile = profile
+        self._profile_interval = profile_interval
+        self._profiled_threads = {threading.get_ident()}
+        self._stacks = {}
+        self._samples = 0
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def add(self, name, start, end, lane=REQUEST_LANE, **args):
+        """记录一个已完成的区间, start/end 为 perf_counter 时间"""
+        event = {
+            'name': name,
+            'ph': 'X',
+            'ts': round((start - self._t0) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1),
+            'pid': self._pid,
+            'tid': lane,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    @contextmanager
+    def span(self, name, lane=REQUEST_LANE, **args):
+        """记录代码块的耗时, 可在块内向返回的字典追加参数"""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.add(name, start, time.perf_counter(), lane, **args)
+
+    def for_chunk(self, index):
+        """为一个翻译块创建追踪上下文, 提交时刻用于计算排队时间"""
+        lane = CHUNK_LANE_BASE + index
+        with self._lock:
+            self._lanes[lane] = f"chunk {index}"
+        return ChunkTrace(self, index, lane)
+
+    def start_profile(self):
+        if not self._profile or self._sampler is not None:
+            return
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"trace-sampler-{self.trace_id}", daemon=True)
+        self._sampler.start()
+
+    def stop_profile(self):
+        if self._sampler is None:
+            return
+        self._stop.set()
+        self._sampler.join()
+
+    def _watch_thread(self, thread_id, active):
+        with self._lock:
+            if active:
+                self._profiled_threads.add(thread_id)
+            else:
+                self._profiled_threads.discard(thread_id)
+
+    def _sample_loop(self):
+        sampler_id = threading.get_ident()
+        while not self._stop.wait(self._profile_interval):
+            with self._lock:
+                watched = set(self._profiled_threads)
+            frames = sys._current_frames()
+            for thread_id in watched:
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                self._stacks[key] = self._stacks.get(key, 0) + 1
+                self._samples += 1
+
+    def to_chrome_trace(self):
+        """导出为 Chrome trace 的 JSON 对象格式"""
+        with self._lock:
+            events = list(self._events)
+            lanes = dict(self._lanes)
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'tid': 0,
+                     'args': {'name': f"mdfanyi {self.trace_id}"}}]
+        for lane, name in sorted(lanes.items()):
+            metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': lane, 'args': {'name': name}})
+            metadata.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': self._pid, 'tid': lane,
+                             'args': {'sort_index': lane}})
+
+        trace = {
+            'traceEvents': metadata + sorted(events, key=lambda e: (e['tid'], e['ts'])),
+            'displayTimeUnit': 'ms',
+            'otherData': {'trace_id': self.trace_id, 'started_at': self.started_at, **self.info},
+        }
+        if self._profile:
+            trace['profile'] = {
+                'interval_ms': self._profile_interval * 1000,
+                'samples': self._samples,
+                'stacks': dict(sorted(self._stacks.items(), key=lambda item: -item[1])),
+            }
+        return trace
+
+    def export(self, path):
+        """写入JSON文件(先写临时文件再替换)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class ChunkTrace:
+    """单个翻译块的追踪上下文, 所有区间都记录在该块自己的时间线上"""
+
+    def __init__(self, trace, index, lane):
+        self.trace = trace
+        self.index = index
+        self.lane = lane
+        self.submitted_at = time.perf_counter()
+
+    def span(self, name, **args):
+        return self.trace.span(name, self.lane, **args)
+
+    def add(self, name, start, end, **args):
+        self.trace.add(name, start, end, self.lane, **args)
+
+    @contextmanager
+    def running(self, **args):
+        """
+        标记块开始执行: 记录排队时间, 并在执行期间把当前线程设为当前追踪上下文
+        """
+        started = time.perf_counter()
+        self.add('queue_wait', self.submitted_at, started)
+        thread_id = threading.get_ident()
+        self.trace._watch_thread(thread_id, True)
+        _local.chunk_trace = self
+        try:
+            with self.span(f"chunk {self.index}", **args) as span_args:
+                yield span_args
+        finally:
+            _local.chunk_trace = None
+            self.trace._watch_thread(thread_id, False)
+
+
+class _NullChunkTrace:
+    """未开启追踪时使用的空实现"""
+
+    def span(self, name, **args):
+        return nullcontext(args)
+
+    def add(self, name, start, end, **args):
+        pass
+
+    def running(self, **args):
+        return nullcontext(args)
+
+
+NULL_CHUNK_TRACE = _NullChunkTrace()
+
+
+class _NullRequestTrace:
+    """未开启追踪的请求使用的空实现"""
+    trace_id = None
+
+    def span(self, name, lane=REQUEST_LANE, **args):
+        return nullcontext(args)
+
+    def for_chunk(self, index):
+        return NULL_CHUNK_TRACE
+
+    def start_profile(self):
+        pass
+
+    def stop_profile(self):
+        pass
+
+
+NULL_REQUEST_TRACE = _NullRequestTrace()
+
+
+def purge_traces(directory, older_than):
+    """删除目录中早于 older_than 秒之前写入的追踪文件, 返回删除的数量"""
+    cutoff = time.time() - older_than
+    removed = 0
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def current_chunk_trace():
+    """返回当前线程正在执行的块的追踪上下文, 没有时返回空实现"""
+    return getattr(_local, 'chunk_trace', None) or NULL_CHUNK_TRACE
@@ -7,6 +7,7 @@ WebInk: Intelligent Web to Markdown Converter
 import argparse
 import re
 import os
+import sys
 import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
@@ -56,24 +57,92 @@ class WebInkConverter:
     
     def convert_to_markdown(self, url, html=None):
         """将网页转换为Markdown"""
+        title, blocks = self.convert_to_markdown_stream(url, html)
+        return title, ''.join(blocks)
+    
+    def convert_to_markdown_stream(self, url, html=None):
+        """
+        将网页转换为Markdown,返回 (标题, Markdown片段迭代器)
+        片段在遍历DOM时逐个产出,多余空行在产出时增量合并
+        """
         if html is None:
             html = self.fetch_url(url)
         
         title, main_content = self.extract_main_content(html)
         
-        # 开始转换
-        markdown = f"# {title}\n\n"
-        markdown += self.process_element(main_content)
+        def blocks():
+            yield f"# {title}\n\n"
+            yield from self.iter_element(main_content)
         
         # 清理多余空行
-        markdown = re.sub(r'\n{3,}', '\n\n', markdown)
-        return title, markdown
+        return title, collapse_blank_lines(blocks())
     
     def process_element(self, element):
         """递归处理HTML元素"""
+        return ''.join(self.iter_element(element))
+    
+    def iter_element(self, element):
+        """递归处理HTML元素,按文档顺序逐个产出Markdown片段"""
         if element is None:
-            return ""
+            return
+        
+        # 表格和列表逐行产出,避免超大表格整体拼接
+        if element.name == 'table':
+            yield from self.iter_table(element)
+            return
+        
+        if element.name in ['ul', 'ol']:
+            yield from self.iter_list(element)
+            return
+        
+        result = self.render_element(element)
+        if result is not None:
+            if result:
+                yield result
+            return
+        
+        # 递归处理子元素
+        for child in element.children:
+            if hasattr(child, 'name') or (hasattr(child, 'string') and child.string and child.string.strip()):
+                yield from self.iter_element(child)
+    
+    def iter_list(self, element):
+        """处理列表,逐项产出"""
+        yield "\n"
+        for i, li in enumerate(element.find_all('li', recursive=False)):
+            marker = "- " if element.name == 'ul' else f"{i+1}. "
+            li_text = self.process_element(li).strip()
+            yield f"{marker}{li_text}\n"
+        yield "\n"
+    
+    def iter_table(self, element):
+        """处理表格,逐行产出"""
+        # 获取表头
+        header_row = element.find('thead').find('tr') if element.find('thead') else None
+        if not header_row:
+            header_row = element.find('tr')
         
+        if header_row:
+            headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
+            yield "| " + " | ".join(headers) + " |\n"
+            yield "| " + " | ".join(['---'] * len(headers)) + " |\n"
+            
+            # 获取表格内容
+            rows = element.find('tbody').find_all('tr') if element.find('tbody') else element.find_all('tr')
+            if element.find('thead') and rows and rows[0] == header_row:
+                rows = rows[1:]
+            
+            for row in rows:
+                cells = [td.get_text().strip() for td in row.find_all(['td', 'th'])]
+                yield "| " + " | ".join(cells) + " |\n"
+            
+            yield "\n"
+    
+    def render_element(self, element):
+        """
+        处理单个HTML元素
+        返回: Markdown文本; 需要递归处理子元素的容器元素返回None
+        """
         result = ""
         
         # 处理标题
@@ -111,16 +180,6 @@ class WebInkConverter:
                 result += f"![{alt}]({src}{title_attr})\n\n"
             return result
         
-        # 处理列表
-        elif element.name in ['ul', 'ol']:
-            result += "\n"
-            for i, li in enumerate(element.find_all('li', recursive=False)):
-                marker = "- " if element.name == 'ul' else f"{i+1}. "
-                li_text = self.process_element(li).strip()
-                result += f"{marker}{li_text}\n"
-            result += "\n"
-            return result
-        
         # 处理列表项
         elif element.name == 'li':
             for child in element.children:
@@ -132,7 +191,9 @@ class WebInkConverter:
         
         # 处理引用
         elif element.name == 'blockquote':
-            inner_content = self.process_element(element).strip()
+            inner_content = ''.join(
+                piece for child in element.children for piece in self.iter_element(child)
+            ).strip()
             result += "\n" + "\n".join(f"> {line}" for line in inner_content.split("\n")) + "\n\n"
             return result
         
@@ -163,30 +224,6 @@ class WebInkConverter:
             result += f"*{element.get_text().strip()}*"
             return result
         
-        # 处理表格
-        elif element.name == 'table':
-            # 获取表头
-            header_row = element.find('thead').find('tr') if element.find('thead') else None
-            if not header_row:
-                header_row = element.find('tr')
-            
-            if header_row:
-                headers = [th.get_text().strip() for th in header_row.find_all(['th', 'td'])]
-                result += "| " + " | ".join(headers) + " |\n"
-                result += "| " + " | ".join(['---'] * len(headers)) + " |\n"
-                
-                # 获取表格内容
-                rows = element.find('tbody').find_all('tr') if element.find('tbody') else element.find_all('tr')
-                if element.find('thead') and rows and rows[0] == header_row:
-                    rows = rows[1:]
-                
-                for row in rows:
-                    cells = [td.get_text().strip() for td in row.find_all(['td', 'th'])]
-                    result += "| " + " | ".join(cells) + " |\n"
-                
-                result += "\n"
-            return result
-        
         # 处理水平线
         elif element.name == 'hr':
             result += "\n---\n\n"
@@ -204,12 +241,32 @@ class WebInkConverter:
                 result += text + " "
             return result
         
-        # 递归处理子元素
-        for child in element.children:
-            if hasattr(child, 'name') or (hasattr(child, 'string') and child.string and child.string.strip()):
-                result += self.process_element(child)
-        
-        return result
+        # 容器元素,由调用方递归处理子元素
+        return None
+
+def collapse_blank_lines(pieces):
+    """
+    增量合并连续3个及以上的换行为2个,效果等同于对拼接结果执行
+    re.sub(r'\n{3,}', '\n\n', ...),但不需要先拼出完整文档
+    """
+    pending_newlines = 0
+    for piece in pieces:
+        output = []
+        for part in re.split(r'(\n+)', piece):
+            if not part:
+                continue
+            if part[0] == '\n':
+                pending_newlines += len(part)
+            else:
+                if pending_newlines:
+                    output.append('\n' * (2 if pending_newlines >= 3 else pending_newlines))
+                    pending_newlines = 0
+                output.append(part)
+        if output:
+            yield ''.join(output)
+    
+    if pending_newlines:
+        yield '\n' * (2 if pending_newlines >= 3 else pending_newlines)
 
 def slugify(text):
     """
@@ -245,17 +302,36 @@ def get_filename_from_url(url, title):
     # 如果URL不包含有用信息，使用主机名
     return slugify(parsed_url.netloc)
 
+def write_markdown(blocks, f):
+    """
+    将Markdown片段逐个写入文件对象,不在内存中拼接完整文档
+    """
+    for block in blocks:
+        f.write(block)
+
 def main():
     parser = argparse.ArgumentParser(description='WebInk: 将网页转换为Markdown格式')
     parser.add_argument('url', help='要转换的网页URL')
-    parser.add_argument('-o', '--output', help='输出文件路径（默认根据标题自动生成）')
+    parser.add_argument('-o', '--output', help='输出文件路径（默认根据标题自动生成，"-" 表示输出到标准输出）')
     parser.add_argument('-d', '--dir', help='输出目录（默认为当前目录）', default='.')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='流式转换：遍历页面时逐段写出，适合超大页面')
     
     args = parser.parse_args()
     
     converter = WebInkConverter()
     try:
-        title, markdown = converter.convert_to_markdown(args.url)
+        if args.stream:
+            title, blocks = converter.convert_to_markdown_stream(args.url)
+        else:
+            title, markdown = converter.convert_to_markdown(args.url)
+            blocks = [markdown]
+        
+        if args.output == '-':
+            # 输出到标准输出
+            write_markdown(blocks, sys.stdout)
+            sys.stdout.flush()
+            return
         
         if args.output:
             # 使用指定的输出文件名
@@ -275,12 +351,12 @@ def main():
         
         # 写入文件
         with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(markdown)
+            write_markdown(blocks, f)
         
         print(f"已保存到 {output_path}")
         
     except Exception as e:
-        print(f"错误: {e}")
+        print(f"错误: {e}", file=sys.stderr if args.output == '-' else sys.stdout)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file